@@ -3,9 +3,18 @@ Main bot application for the Telegram Claude Bot.
 Sets up and runs the Telegram bot with all handlers.
 """
 
+import asyncio
 import logging
+import importlib.util
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
+from telegram.ext import (
+    AIORateLimiter,
+    Application,
+    CommandHandler,
+    MessageHandler,
+    CallbackQueryHandler,
+    filters
+)
 
 from .config import config
 from .handlers import (
@@ -19,6 +28,15 @@ from .handlers import (
 )
 from .claude_manager import get_claude_manager, shutdown_claude_manager
 
+# uvloop is optional (not available on Windows); the default loop is used without it
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# HTTP/2 needs the h2 package (python-telegram-bot[http2]); fall back to HTTP/1.1 without it
+_HTTP_VERSION = '2' if importlib.util.find_spec('h2') is not None else '1.1'
+
 # Configure logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -39,7 +57,7 @@ async def post_init(application: Application):
             await get_claude_manager()
             logger.info("✓ Claude CLI initialized successfully")
         except Exception as e:
-            logger.error(f"Failed to initialize Claude CLI: {e}")
+            logger.error("Failed to initialize Claude CLI: %s", e)
             logger.warning("Bot will attempt to start Claude CLI on first use")
 
 
@@ -57,10 +75,30 @@ async def post_shutdown(application: Application):
 def main():
     """Start the bot."""
     logger.info("Starting Telegram Claude Bot...")
-    logger.info(f"Mode: {'CLI' if config.use_cli else 'SDK'}")
+    logger.info("Mode: %s", 'CLI' if config.use_cli else 'SDK')
+
+    if uvloop is not None:
+        # run_polling creates its loop through the policy, so set it first
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        logger.info("Using uvloop event loop")
 
     # Create application
-    application = Application.builder().token(config.telegram_token).build()
+    # Updates are processed concurrently so a slow Claude turn in one chat
+    # doesn't block other chats (or permission callbacks); turns within a
+    # chat are serialized by the session manager's per-chat locks.
+    application = (
+        Application.builder()
+        .token(config.telegram_token)
+        .concurrent_updates(True)
+        # Keep every Bot API call (replies, chunks, chat actions, edits) under
+        # Telegram's flood limits - 30 msg/s overall, 20 msg/min per group -
+        # and wait out RetryAfter instead of failing the send
+        .rate_limiter(AIORateLimiter(max_retries=3))
+        # Concurrent replies share multiplexed connections instead of each
+        # taking a pooled HTTP/1.1 connection; long polling keeps its own
+        .http_version(_HTTP_VERSION)
+        .build()
+    )
 
     # Add command handlers
     application.add_handler(CommandHandler("start", start_command))
@@ -71,10 +109,13 @@ def main():
     # Add callback query handler for permission approvals
     application.add_handler(CallbackQueryHandler(handle_permission_callback))
 
-    # Add message handlers
-    application.add_handler(MessageHandler(filters.PHOTO, handle_message))
-    application.add_handler(MessageHandler(filters.Document.ALL, handle_message))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    # Add message handler for photos, documents and plain text; edits of
+    # earlier messages aren't answered again
+    application.add_handler(MessageHandler(
+        filters.UpdateType.MESSAGE
+        & (filters.PHOTO | filters.Document.ALL | (filters.TEXT & ~filters.COMMAND)),
+        handle_message
+    ))
 
     # Add error handler
     application.add_error_handler(error_handler)
@@ -1,29 +1,176 @@
 """
 Claude CLI process management for the Telegram Claude Bot.
-Handles communication with Claude CLI using --print mode.
+Keeps one long-lived Claude CLI process per chat, driven over the CLI's
+stream-json protocol (--input-format/--output-format stream-json).
 """
 
 import os
+import json
+import shutil
+import signal
+import time
 import logging
 import asyncio
+import weakref
 import tempfile
-from typing import Optional
+from collections import OrderedDict
+from typing import List, Optional
 
 from .config import config, ERROR_MESSAGES
 
 logger = logging.getLogger(__name__)
 
+# Stream-json events carry whole tool results on a single line, so allow
+# much longer lines than asyncio's 64 KiB default
+_STREAM_LIMIT = 32 * 1024 * 1024
+
+# How long a process gets to exit on its own before being killed
+_STOP_TIMEOUT = 5.0
+# Bytes of a process's stderr kept for error reports
+_STDERR_TAIL = 8192
+# POSIX: run each CLI process in its own group so its children can be signalled too
+_USE_PROCESS_GROUPS = hasattr(os, 'killpg')
+
+# Session directories are named <tempdir>/<prefix><chat_id>
+_SESSION_DIR_PREFIX = 'claude_telegram_chat_'
+
+# How often to look for stale session directories (seconds)
+_SWEEP_INTERVAL = 600.0
+# How often to look for idle CLI processes (seconds)
+_IDLE_CHECK_INTERVAL = 60.0
+
+
+def _find_stale_session_dirs(base_dir: str, cutoff: float) -> List[str]:
+    """
+    Find session directories not modified since cutoff (blocking).
+
+    Args:
+        base_dir: Directory holding the session directories
+        cutoff: Epoch timestamp; older directories are stale
+
+    Returns:
+        Paths of the stale session directories
+    """
+    stale = []
+    with os.scandir(base_dir) as entries:
+        for entry in entries:
+            if not entry.name.startswith(_SESSION_DIR_PREFIX):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                    stale.append(entry.path)
+            except FileNotFoundError:
+                pass
+    return stale
+
+
+def _move_aside(path: str) -> Optional[str]:
+    """
+    Rename a directory to a unique name next to it (blocking).
+
+    The new name keeps the session directory prefix, so a copy left behind
+    by a crash is still picked up by the stale-directory sweep.
+
+    Args:
+        path: Directory to move
+
+    Returns:
+        The directory's new path, or None if it doesn't exist
+    """
+    moved = f"{path}.trash-{time.monotonic_ns()}"
+    try:
+        os.rename(path, moved)
+    except FileNotFoundError:
+        return None
+    return moved
+
+
+def _touch_dir(path: str) -> None:
+    """
+    Set a directory's mtime to now, ignoring errors (blocking).
+
+    Args:
+        path: Directory to touch
+    """
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+async def _drain_stderr(stream: asyncio.StreamReader, tail: bytearray) -> None:
+    """
+    Read a stream until EOF, keeping only its last _STDERR_TAIL bytes.
+
+    Args:
+        stream: Process stderr stream
+        tail: Buffer updated in place with the most recent output
+    """
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            return
+        tail.extend(chunk)
+        del tail[:-_STDERR_TAIL]
+
+
+def _signal_process(process: asyncio.subprocess.Process, force: bool = False) -> None:
+    """
+    Terminate or kill a process together with any children it spawned.
+
+    Args:
+        process: Process started as its own process group leader
+        force: Send SIGKILL instead of SIGTERM
+    """
+    if _USE_PROCESS_GROUPS:
+        os.killpg(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+    elif force:
+        process.kill()
+    else:
+        process.terminate()
+
 
 class ClaudeProcessManager:
-    """Manages persistent Claude CLI processes using --print mode for non-interactive communication."""
+    """Manages persistent Claude CLI processes, one per chat, in stream-json mode."""
 
     def __init__(self):
         """Initialize the Claude process manager."""
-        self.lock = asyncio.Lock()
-        # Track session directories per chat_id
-        self.session_dirs: dict[int, str] = {}
-
-    def _get_session_dir(self, chat_id: int) -> str:
+        # Track session directories per chat_id, least recently used first
+        self.session_dirs: OrderedDict[int, str] = OrderedDict()
+        # Long-lived claude process per chat_id
+        self.processes: dict[int, asyncio.subprocess.Process] = {}
+        # When each chat's process last finished a turn (time.monotonic())
+        self._last_used: dict[int, float] = {}
+        # A process handles one turn at a time, so prompts are serialized per chat.
+        # Held weakly so chats that are gone don't keep theirs alive
+        self.chat_locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        # Most recent stderr output per chat, filled by a drain task per process
+        self._stderr_tails: dict[int, bytearray] = {}
+        self._stderr_drains: dict[int, asyncio.Task] = {}
+        # Chats cleared since their last spawn; their next process must not
+        # resume the conversation the CLI still has stored for the directory
+        self._fresh_starts: set[int] = set()
+        # Background task removing stale session directories
+        self._sweeper: Optional[asyncio.Task] = None
+        # Parent of all session directories, resolved once
+        self._base_dir = tempfile.gettempdir()
+
+        # The command line only depends on config, so it's built once.
+        # --continue picks the conversation back up if a process is respawned;
+        # it's kept last so the first spawn after a clear can leave it off
+        permission_arg = 'bypassPermissions' if config.permission_mode == 'bypass' else 'default'
+        self._cmd: tuple[str, ...] = (
+            'claude',
+            '--print',
+            '--input-format', 'stream-json',
+            '--output-format', 'stream-json',
+            '--verbose',
+            '--permission-mode', permission_arg,
+            '--continue',
+        )
+        self._fresh_cmd: tuple[str, ...] = self._cmd[:-1]
+
+    async def _get_session_dir(self, chat_id: int) -> str:
         """
         Get or create session directory for a specific chat.
 
@@ -33,29 +180,248 @@ class ClaudeProcessManager:
         Returns:
             Path to the session directory
         """
-        if chat_id not in self.session_dirs:
-            # Create a persistent session directory for this chat
-            session_dir = os.path.join(
-                tempfile.gettempdir(),
-                f'claude_telegram_chat_{chat_id}'
-            )
-            os.makedirs(session_dir, exist_ok=True)
-            self.session_dirs[chat_id] = session_dir
-            logger.info(f"✓ Created Claude CLI session directory for chat {chat_id}: {session_dir}")
+        session_dir = self.session_dirs.get(chat_id)
+        if session_dir is not None:
+            return session_dir
+
+        # Make room first, dropping the least recently used idle sessions
+        await self._evict_sessions(config.max_session_dirs - 1)
+
+        # Create a persistent session directory for this chat
+        session_dir = os.path.join(self._base_dir, f'{_SESSION_DIR_PREFIX}{chat_id}')
+        await asyncio.to_thread(os.makedirs, session_dir, exist_ok=True)
+        self.session_dirs[chat_id] = session_dir
+        logger.info("✓ Created Claude CLI session directory for chat %s: %s", chat_id, session_dir)
+        return session_dir
+
+    async def _touch_session(self, chat_id: int) -> None:
+        """
+        Mark a chat's session as recently used.
+
+        Moves it to the back of the LRU order and bumps the directory's
+        mtime, which the stale-session sweep goes by.
+
+        Args:
+            chat_id: Telegram chat ID
+        """
+        session_dir = self.session_dirs.get(chat_id)
+        if session_dir is None:
+            return
+        self.session_dirs.move_to_end(chat_id)
+        await asyncio.to_thread(_touch_dir, session_dir)
+
+    async def _evict_sessions(self, capacity: int) -> None:
+        """
+        Clear least recently used sessions until at most capacity remain.
+
+        Chats with a turn in progress are skipped.
+
+        Args:
+            capacity: Number of session directories to keep
+        """
+        excess = len(self.session_dirs) - max(capacity, 0)
+        if excess <= 0:
+            return
+
+        idle = [
+            chat_id for chat_id in self.session_dirs
+            if not self._get_lock(chat_id).locked()
+        ][:excess]
+        for chat_id in idle:
+            logger.info("Evicting least recently used Claude CLI session for chat %s", chat_id)
+            await self.clear_chat_session(chat_id)
+
+    async def _sweep_stale_sessions(self) -> None:
+        """Clear session directories that haven't been used within the TTL."""
+        cutoff = time.time() - config.session_dir_ttl_hours * 3600
+        stale_dirs = await asyncio.to_thread(
+            _find_stale_session_dirs, self._base_dir, cutoff
+        )
+
+        chats_by_dir = {session_dir: chat_id for chat_id, session_dir in self.session_dirs.items()}
+        for session_dir in stale_dirs:
+            chat_id = chats_by_dir.get(session_dir)
+            if chat_id is None:
+                # Left over from a previous run
+                await asyncio.to_thread(shutil.rmtree, session_dir, ignore_errors=True)
+                logger.info("Removed stale Claude CLI session directory: %s", session_dir)
+            elif not self._get_lock(chat_id).locked():
+                logger.info("Clearing idle Claude CLI session for chat %s", chat_id)
+                await self.clear_chat_session(chat_id)
+
+    async def _stop_idle_processes(self) -> None:
+        """
+        Stop processes that haven't had a turn within the idle timeout.
 
-        return self.session_dirs[chat_id]
+        The session directory is kept, so the next prompt respawns the
+        process and --continue resumes the conversation.
+        """
+        cutoff = time.monotonic() - config.cli_idle_timeout_minutes * 60
+        idle = [chat_id for chat_id, last_used in self._last_used.items() if last_used < cutoff]
+        for chat_id in idle:
+            lock = self._get_lock(chat_id)
+            if lock.locked():
+                continue
+            async with lock:
+                logger.info("Stopping idle Claude CLI process for chat %s", chat_id)
+                await self._stop_process(chat_id)
+
+    async def _sweep_loop(self) -> None:
+        """Periodically stop idle processes and clear stale session directories."""
+        last_sweep = time.monotonic()
+        while True:
+            await asyncio.sleep(_IDLE_CHECK_INTERVAL)
+            try:
+                await self._stop_idle_processes()
+                if time.monotonic() - last_sweep >= _SWEEP_INTERVAL:
+                    last_sweep = time.monotonic()
+                    await self._sweep_stale_sessions()
+            except Exception as e:
+                logger.error("Error sweeping stale Claude CLI sessions: %s", e, exc_info=True)
 
     async def start(self):
         """Initialize the Claude process manager."""
         try:
+            if self._sweeper is None:
+                self._sweeper = asyncio.create_task(self._sweep_loop())
             logger.info("Claude CLI process manager initialized")
         except Exception as e:
-            logger.error(f"Error initializing Claude process manager: {e}")
+            logger.error("Error initializing Claude process manager: %s", e)
             raise
 
+    def _get_lock(self, chat_id: int) -> asyncio.Lock:
+        """
+        Get the lock guarding a chat's Claude process.
+
+        Args:
+            chat_id: Telegram chat ID
+
+        Returns:
+            asyncio.Lock for the chat
+        """
+        lock = self.chat_locks.get(chat_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.chat_locks[chat_id] = lock
+        return lock
+
+    async def _get_process(self, chat_id: int) -> asyncio.subprocess.Process:
+        """
+        Get the running Claude process for a chat, spawning it if needed.
+
+        Args:
+            chat_id: Telegram chat ID
+
+        Returns:
+            Running Claude CLI process
+        """
+        process = self.processes.get(chat_id)
+        if process is not None and process.returncode is None:
+            return process
+
+        session_dir = await self._get_session_dir(chat_id)
+
+        # Spawned on the event loop: the process's pipes must be asyncio
+        # streams, so the fork/exec blocks the loop briefly on every (re)start
+        cmd = self._fresh_cmd if chat_id in self._fresh_starts else self._cmd
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=session_dir,
+            limit=_STREAM_LIMIT,
+            # Own process group, so tool subprocesses are stopped along with it
+            start_new_session=_USE_PROCESS_GROUPS
+        )
+        self.processes[chat_id] = process
+        self._fresh_starts.discard(chat_id)
+
+        # stderr must be read continuously, or a chatty process fills the pipe
+        # and blocks mid-turn; only the tail is kept for error reports
+        tail = bytearray()
+        self._stderr_tails[chat_id] = tail
+        self._stderr_drains[chat_id] = asyncio.create_task(_drain_stderr(process.stderr, tail))
+
+        logger.info("✓ Started Claude CLI process for chat %s (pid %s)", chat_id, process.pid)
+        return process
+
+    async def _stop_process(self, chat_id: int) -> None:
+        """
+        Stop a chat's Claude process, killing it if it doesn't exit in time.
+
+        Args:
+            chat_id: Telegram chat ID
+        """
+        process = self.processes.pop(chat_id, None)
+        self._last_used.pop(chat_id, None)
+        self._stderr_tails.pop(chat_id, None)
+        drain = self._stderr_drains.pop(chat_id, None)
+        if drain is not None:
+            drain.cancel()
+        if process is None or process.returncode is not None:
+            return
+
+        try:
+            _signal_process(process)
+            await asyncio.wait_for(process.wait(), timeout=_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            try:
+                _signal_process(process, force=True)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+        except ProcessLookupError:
+            pass
+        logger.info("Stopped Claude CLI process for chat %s", chat_id)
+
+    async def _read_response(self, chat_id: int, process: asyncio.subprocess.Process) -> str:
+        """
+        Read stream-json events until the result of the current turn.
+
+        Args:
+            chat_id: Telegram chat ID the process belongs to
+            process: Claude CLI process the prompt was written to
+
+        Returns:
+            Claude's response as a string
+        """
+        while True:
+            try:
+                line = await process.stdout.readline()
+            except ValueError:
+                # Oversized line; its contents were discarded by the reader
+                continue
+
+            if not line:
+                # The process exited mid-turn
+                await process.wait()
+                drain = self._stderr_drains.get(chat_id)
+                if drain is not None:
+                    await drain
+                tail = self._stderr_tails.get(chat_id, b'')
+                error_msg = tail.decode('utf-8', 'replace').strip()
+                error_msg = error_msg or f"process exited with code {process.returncode}"
+                logger.error("Claude CLI error: %s", error_msg)
+                return f"❌ Claude CLI error: {error_msg}"
+
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+
+            if not isinstance(event, dict) or event.get('type') != 'result':
+                continue
+
+            response = str(event.get('result') or '').strip()
+            if event.get('is_error'):
+                logger.error("Claude CLI error: %s", response)
+                return f"❌ Claude CLI error: {response}"
+            return response if response else ERROR_MESSAGES['no_response']
+
     async def send_prompt(self, prompt: str, chat_id: int, timeout: Optional[float] = None) -> str:
         """
-        Send a prompt to Claude CLI using --print mode (non-interactive).
+        Send a prompt to the chat's Claude CLI process.
 
         Args:
             prompt: The prompt to send
@@ -68,94 +434,88 @@ class ClaudeProcessManager:
         if timeout is None:
             timeout = config.claude_timeout
 
-        async with self.lock:
+        async with self._get_lock(chat_id):
             try:
-                # Get the session directory for this specific chat
-                session_dir = self._get_session_dir(chat_id)
-
-                # Use --print mode for non-interactive output with --continue to maintain session
-                # Use permission mode from config
-                permission_arg = 'bypassPermissions' if config.permission_mode == 'bypass' else 'default'
-                cmd = [
-                    'claude',
-                    '--print',
-                    '--permission-mode', permission_arg,
-                    '--continue',  # Continue the most recent conversation
-                    prompt
-                ]
-
-                logger.info(f"Sending prompt to Claude CLI (--print mode) for chat {chat_id}")
-
-                # Run claude command in the session directory
-                process = await asyncio.create_subprocess_exec(
-                    *cmd,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
-                    cwd=session_dir
-                )
+                process = await self._get_process(chat_id)
+                await self._touch_session(chat_id)
+                # Error reports only cover stderr written during this turn
+                self._stderr_tails[chat_id].clear()
+
+                logger.info("Sending prompt to Claude CLI (stream-json mode) for chat %s", chat_id)
+
+                message = {
+                    'type': 'user',
+                    'message': {'role': 'user', 'content': prompt}
+                }
+                process.stdin.write(json.dumps(message).encode('utf-8') + b'\n')
+                await process.stdin.drain()
 
                 try:
-                    stdout, stderr = await asyncio.wait_for(
-                        process.communicate(),
-                        timeout=timeout
-                    )
+                    return await asyncio.wait_for(self._read_response(chat_id, process), timeout=timeout)
                 except asyncio.TimeoutError:
+                    # The turn may still be running; drop the process so the
+                    # next prompt starts from a clean one
                     logger.error("Timeout waiting for Claude response")
-                    process.kill()
-                    await process.wait()
+                    await self._stop_process(chat_id)
                     return ERROR_MESSAGES['timeout']
 
-                if process.returncode != 0:
-                    error_msg = stderr.decode('utf-8').strip()
-                    logger.error(f"Claude CLI error: {error_msg}")
-                    return f"❌ Claude CLI error: {error_msg}"
-
-                response = stdout.decode('utf-8').strip()
-                return response if response else ERROR_MESSAGES['no_response']
-
             except FileNotFoundError:
                 return ERROR_MESSAGES['claude_cli_not_found']
+            except (BrokenPipeError, ConnectionResetError):
+                logger.error("Claude CLI process for chat %s exited unexpectedly", chat_id)
+                await self._stop_process(chat_id)
+                return "❌ Claude CLI error: process exited unexpectedly. Please try again."
             except Exception as e:
-                logger.error(f"Error communicating with Claude: {e}", exc_info=True)
+                logger.error("Error communicating with Claude: %s", e, exc_info=True)
                 return f"❌ Error: {str(e)}"
+            finally:
+                if chat_id in self.processes:
+                    self._last_used[chat_id] = time.monotonic()
 
     async def stop(self):
-        """Cleanup session directory."""
-        logger.info("Claude CLI session cleanup (no persistent process to stop)")
-
-    def clear_chat_session(self, chat_id: int) -> None:
+        """Stop all Claude CLI processes and the stale-session sweep."""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        # Each process gets up to _STOP_TIMEOUT to exit, so stop them together
+        await asyncio.gather(*(self._stop_process(chat_id) for chat_id in list(self.processes)))
+
+    async def clear_chat_session(self, chat_id: int) -> None:
         """
-        Clear the session directory for a specific chat.
+        Stop the Claude process and clear the session directory for a specific chat.
 
         Args:
             chat_id: Telegram chat ID
         """
-        import shutil
-
-        if chat_id in self.session_dirs:
-            session_dir = self.session_dirs[chat_id]
+        # The directory path is fixed per chat, so it's renamed out of the way
+        # under the chat lock; the (slower) delete runs after the lock is
+        # released, so a prompt arriving meanwhile only waits for the rename
+        async with self._get_lock(chat_id):
+            await self._stop_process(chat_id)
+            # The CLI keeps conversations outside the session directory (keyed
+            # by its path), so --continue would pick the old one back up
+            self._fresh_starts.add(chat_id)
+
+            session_dir = self.session_dirs.pop(chat_id, None)
+            if session_dir is None:
+                return
             try:
-                if os.path.exists(session_dir):
-                    shutil.rmtree(session_dir)
-                    logger.info(f"✓ Cleared Claude CLI session for chat {chat_id}")
-            except Exception as e:
-                logger.error(f"Error clearing session for chat {chat_id}: {e}")
+                moved_dir = await asyncio.to_thread(_move_aside, session_dir)
+            except OSError:
+                # Couldn't rename; delete in place while still holding the lock
+                await asyncio.to_thread(shutil.rmtree, session_dir, ignore_errors=True)
+                moved_dir = None
 
-            # Remove from tracking
-            del self.session_dirs[chat_id]
-
-    def is_alive(self) -> bool:
-        """
-        Check if process manager is initialized.
-
-        Returns:
-            True (manager is always ready)
-        """
-        return True
+        if moved_dir is not None:
+            await asyncio.to_thread(shutil.rmtree, moved_dir, ignore_errors=True)
+        logger.info("✓ Cleared Claude CLI session for chat %s", chat_id)
 
 
 # Global Claude process manager instance
 _claude_process_manager: Optional[ClaudeProcessManager] = None
+# Serializes first-time initialization; created on first use so it belongs to
+# the running event loop
+_init_lock: Optional[asyncio.Lock] = None
 
 
 async def get_claude_manager() -> ClaudeProcessManager:
@@ -165,16 +525,17 @@ async def get_claude_manager() -> ClaudeProcessManager:
     Returns:
         ClaudeProcessManager instance
     """
-    global _claude_process_manager
+    global _claude_process_manager, _init_lock
 
     if _claude_process_manager is None:
-        _claude_process_manager = ClaudeProcessManager()
-        await _claude_process_manager.start()
-
-    # Check if process is alive, restart if needed
-    if not _claude_process_manager.is_alive():
-        logger.warning("Claude process died, restarting...")
-        await _claude_process_manager.start()
+        if _init_lock is None:
+            _init_lock = asyncio.Lock()
+        async with _init_lock:
+            if _claude_process_manager is None:
+                # Only published once started, so callers never see a half-initialized manager
+                manager = ClaudeProcessManager()
+                await manager.start()
+                _claude_process_manager = manager
 
     return _claude_process_manager
 
@@ -184,7 +545,7 @@ async def shutdown_claude_manager():
     global _claude_process_manager
 
     if _claude_process_manager:
-        logger.info("Shutting down Claude CLI process...")
+        logger.info("Shutting down Claude CLI processes...")
         await _claude_process_manager.stop()
-        logger.info("✓ Claude CLI process stopped")
+        logger.info("✓ Claude CLI processes stopped")
         _claude_process_manager = None
@@ -6,6 +6,7 @@ Centralizes all configuration settings and environment variable management.
 import os
 import logging
 from dataclasses import dataclass
+from types import MappingProxyType
 from typing import Optional
 from dotenv import load_dotenv
 
@@ -15,7 +16,32 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 
 
-@dataclass
+def _get_number_env(name: str, default, cast):
+    """
+    Read a positive number from an environment variable.
+
+    Args:
+        name: Environment variable name
+        default: Value used when the variable is unset or invalid
+        cast: Type to convert the value to (int or float)
+
+    Returns:
+        The parsed value, or default
+    """
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        number = cast(value)
+    except ValueError:
+        number = None
+    if number is None or number <= 0:
+        logger.warning("Invalid %s '%s', defaulting to %s", name, value, default)
+        return default
+    return number
+
+
+@dataclass(frozen=True, slots=True)
 class BotConfig:
     """Bot configuration class."""
 
@@ -24,8 +50,15 @@ class BotConfig:
     use_cli: bool
     permission_mode: str = 'interactive'  # 'interactive' or 'bypass'
     max_history_length: int = 20
-    max_message_length: int = 4000
+    max_history_chars: int = 100_000  # Size budget for the history sent with each SDK prompt
+    max_message_length: int = 4096  # Telegram's text message limit
     claude_timeout: float = 300.0
+    max_session_dirs: int = 500  # CLI session directories kept before evicting the oldest
+    session_dir_ttl_hours: float = 24.0  # Idle CLI session directories are removed after this
+    cli_idle_timeout_minutes: float = 15.0  # Idle CLI processes are stopped after this (session kept)
+    history_dir: Optional[str] = None  # Where chat transcripts are persisted (memory only if unset)
+    max_cached_chats: int = 1000  # Chats whose history is kept in memory before evicting the oldest
+    batch_prompts: bool = False  # Merge text messages queued behind a running turn into one prompt
 
     @classmethod
     def from_env(cls) -> 'BotConfig':
@@ -46,9 +79,16 @@ class BotConfig:
         anthropic_api_key = os.getenv('ANTHROPIC_API_KEY')
         permission_mode = os.getenv('PERMISSION_MODE', 'interactive').lower()
 
+        max_session_dirs = _get_number_env('MAX_SESSION_DIRS', 500, int)
+        session_dir_ttl_hours = _get_number_env('SESSION_DIR_TTL_HOURS', 24.0, float)
+        cli_idle_timeout_minutes = _get_number_env('CLI_IDLE_TIMEOUT_MINUTES', 15.0, float)
+        history_dir = os.getenv('HISTORY_DIR') or None
+        max_cached_chats = _get_number_env('MAX_CACHED_CHATS', 1000, int)
+        batch_prompts = os.getenv('BATCH_PROMPTS', 'false').lower() == 'true'
+
         # Validate permission mode
         if permission_mode not in ['interactive', 'bypass']:
-            logger.warning(f"Invalid PERMISSION_MODE '{permission_mode}', defaulting to 'interactive'")
+            logger.warning("Invalid PERMISSION_MODE '%s', defaulting to 'interactive'", permission_mode)
             permission_mode = 'interactive'
 
         if not use_cli and not anthropic_api_key:
@@ -66,13 +106,19 @@ class BotConfig:
             logger.warning("CLI mode doesn't support interactive permissions (requires TTY). Using bypass mode instead.")
             permission_mode = 'bypass'
 
-        logger.info(f"Configuration loaded - Mode: {'CLI' if use_cli else 'SDK'}, Permission: {permission_mode}")
+        logger.info("Configuration loaded - Mode: %s, Permission: %s", 'CLI' if use_cli else 'SDK', permission_mode)
 
         return cls(
             telegram_token=telegram_token,
             anthropic_api_key=anthropic_api_key,
             use_cli=use_cli,
-            permission_mode=permission_mode
+            permission_mode=permission_mode,
+            max_session_dirs=max_session_dirs,
+            session_dir_ttl_hours=session_dir_ttl_hours,
+            cli_idle_timeout_minutes=cli_idle_timeout_minutes,
+            history_dir=history_dir,
+            max_cached_chats=max_cached_chats,
+            batch_prompts=batch_prompts
         )
 
 
@@ -80,8 +126,8 @@ class BotConfig:
 config = BotConfig.from_env()
 
 
-# Error messages
-ERROR_MESSAGES = {
+# Error messages (read-only, shared by all handlers)
+ERROR_MESSAGES = MappingProxyType({
     'claude_cli_not_found': (
         "❌ Claude CLI not found. Please make sure 'claude' command is installed "
         "and available in your PATH."
@@ -89,7 +135,7 @@ ERROR_MESSAGES = {
     'timeout': "❌ Timeout: Claude took too long to respond. Please try again.",
     'no_response': "⚠️ No response received from Claude.",
     'no_text_response': "⚠️ No text response received from Claude.",
-}
+})
 
 
 # Welcome message
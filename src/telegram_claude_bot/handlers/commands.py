@@ -4,8 +4,9 @@ Handles /start, /clear, /help, and /screenshot commands.
 """
 
 import os
+import asyncio
 import logging
-from telegram import Update
+from telegram import InputFile, Update
 from telegram.ext import ContextTypes
 
 from ..config import WELCOME_MESSAGE, HELP_MESSAGE
@@ -25,10 +26,12 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     chat_id = update.effective_chat.id
     session_manager = get_session_manager()
-    session_manager.clear_history(chat_id)
+    # Wait for a turn in progress, which would otherwise add its messages back
+    async with session_manager.get_lock(chat_id):
+        await session_manager.clear_history(chat_id)
 
     await update.message.reply_text(WELCOME_MESSAGE)
-    logger.info(f"Started new conversation for chat {chat_id}")
+    logger.info("Started new conversation for chat %s", chat_id)
 
 
 async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -41,10 +44,15 @@ async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     chat_id = update.effective_chat.id
     session_manager = get_session_manager()
-    await session_manager.clear_all(chat_id)
+
+    # Acknowledge without waiting for a turn in progress to finish, the CLI
+    # process to stop and its session directory to be removed. The task
+    # starts before any later message from this chat is handled, and takes
+    # the chat's lock first; errors reach the error handler
+    context.application.create_task(session_manager.clear_all(chat_id), update=update)
 
     await update.message.reply_text("🗑️ Conversation history cleared!")
-    logger.info(f"Cleared conversation history for chat {chat_id}")
+    logger.info("Cleared conversation history for chat %s", chat_id)
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -75,20 +83,36 @@ async def screenshot_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Capture screenshot
         screenshot_path = await capture_screenshot(chat_id)
 
-        if screenshot_path and os.path.exists(screenshot_path):
+        if screenshot_path:
+            # Read and clean up the temporary file off the event loop
+            image_data = await asyncio.to_thread(_read_and_remove, screenshot_path)
+
             # Send the screenshot to Telegram
-            with open(screenshot_path, 'rb') as photo_file:
-                await update.message.reply_photo(
-                    photo=photo_file,
-                    caption="📸 Screenshot captured"
-                )
-
-            # Clean up the temporary file
-            os.remove(screenshot_path)
-            logger.info(f"Screenshot sent successfully to chat {chat_id}")
+            await update.message.reply_photo(
+                photo=InputFile(image_data, filename="screenshot.png"),
+                caption="📸 Screenshot captured"
+            )
+            logger.info("Screenshot sent successfully to chat %s", chat_id)
         else:
             await update.message.reply_text(get_screenshot_error_message())
 
     except Exception as e:
-        logger.error(f"Error in screenshot command: {e}", exc_info=True)
+        logger.error("Error in screenshot command: %s", e, exc_info=True)
         await update.message.reply_text(f"❌ Error capturing screenshot: {str(e)}")
+
+
+def _read_and_remove(path: str) -> bytes:
+    """
+    Read a temporary file and delete it (blocking).
+
+    Args:
+        path: File to read
+
+    Returns:
+        File contents
+    """
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(path)
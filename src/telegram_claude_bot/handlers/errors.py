@@ -18,4 +18,4 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         update: Telegram update object
         context: Telegram context object
     """
-    logger.error(f"Update {update} caused error {context.error}", exc_info=context.error)
+    logger.error("Update %s caused error %s", update, context.error, exc_info=context.error)
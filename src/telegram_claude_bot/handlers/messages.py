@@ -4,27 +4,136 @@ Handles text messages, images, and documents.
 """
 
 import os
-import base64
+import asyncio
 import logging
 import tempfile
-from io import BytesIO
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Tuple, Union
 
-from telegram import Update
+from telegram import InputFile, Update
 from telegram.ext import ContextTypes
 
+# pybase64 is an optional, much faster drop-in for the stdlib module
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
 from ..config import config, ERROR_MESSAGES
 from ..session import get_session_manager
-from ..utils import split_message, extract_image_paths, send_image_from_path, format_context_messages
+from ..utils import split_message, extract_image_paths, load_image_from_path
 from ..claude_manager import get_claude_manager
 from ..interactive_sdk import query_claude_with_permissions, query_claude_bypass
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class Attachment:
+    """A file sent along with a message."""
+    kind: str  # 'image' or 'file'
+    data: bytes
+    name: Optional[str] = None
+    mime_type: Optional[str] = None
+
+
+# Leading bytes of image formats Claude can read (PNG, JPEG, GIF); WebP is
+# checked separately since its RIFF header is shared with audio/video files
+_IMAGE_SIGNATURES = (b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff', b'GIF87a', b'GIF89a')
+
+# Directory attached images are saved to for Claude to read
+_TEMP_DIR = tempfile.gettempdir()
+
+# Pending (update, context) pairs per chat, each queue drained by a single worker task
+_chat_queues: Dict[int, Deque[Tuple[Update, ContextTypes.DEFAULT_TYPE]]] = {}
+
+# Reply sent when processing fails, per attachment kind (None for plain text)
+_ERROR_REPLIES = {
+    None: "❌ An error occurred while processing your request.\nError: {error}",
+    'image': "❌ Error processing image: {error}",
+    'file': "❌ Error processing file: {error}",
+}
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Handle incoming messages (text, images, documents).
 
+    Messages are queued per chat and processed in order by a single worker
+    task for that chat, so different chats run concurrently while each
+    chat's turns never interleave. The update is acknowledged right away.
+
+    Args:
+        update: Telegram update object
+        context: Telegram context object
+    """
+    chat_id = update.effective_chat.id
+
+    queue = _chat_queues.get(chat_id)
+    if queue is None:
+        queue = deque()
+        _chat_queues[chat_id] = queue
+        context.application.create_task(_chat_worker(chat_id, queue), update=update)
+
+    queue.append((update, context))
+
+
+async def _chat_worker(chat_id: int, queue: Deque[Tuple[Update, ContextTypes.DEFAULT_TYPE]]):
+    """
+    Process a chat's queued messages one at a time until the queue is empty.
+
+    With batch_prompts enabled, consecutive text messages that queued up
+    behind a running turn are sent to Claude together as one prompt.
+
+    Args:
+        chat_id: Telegram chat ID
+        queue: The chat's queue of (update, context) pairs
+    """
+    try:
+        while queue:
+            update, context = queue.popleft()
+            try:
+                if config.batch_prompts and _is_text(update) and queue and _is_text(queue[0][0]):
+                    texts = [update.message.text]
+                    while queue and _is_text(queue[0][0]):
+                        update, context = queue.popleft()
+                        texts.append(update.message.text)
+                    logger.info("Batching %s queued messages for chat %s", len(texts), chat_id)
+                    # Replies go to the latest of the merged messages
+                    await _respond(update, context, chat_id, "\n\n".join(texts))
+                else:
+                    await _process_message(update, context)
+            except Exception as e:
+                logger.error("Error processing message for chat %s: %s", chat_id, e, exc_info=True)
+    finally:
+        # No await between the final emptiness check and this, so a message
+        # arriving now gets a fresh queue and worker
+        _chat_queues.pop(chat_id, None)
+
+
+def _is_text(update: Update) -> bool:
+    """
+    Check whether an update is a plain text message.
+
+    Args:
+        update: Telegram update object
+
+    Returns:
+        True if the message has text and no photo or document; False for
+        updates without a new message, such as edits
+    """
+    message = update.message
+    return (
+        message is not None and bool(message.text)
+        and not message.photo and message.document is None
+    )
+
+
+async def _process_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Process a single message (text, image, or document).
+
     Args:
         update: Telegram update object
         context: Telegram context object
@@ -49,83 +158,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Please send a text message, image, or file.")
         return
 
-    await _handle_text_message(update, context, chat_id, text)
-
-
-async def _handle_text_message(
-    update: Update,
-    context: ContextTypes.DEFAULT_TYPE,
-    chat_id: int,
-    text: str
-):
-    """
-    Handle text messages.
-
-    Args:
-        update: Telegram update object
-        context: Telegram context object
-        chat_id: Telegram chat ID
-        text: Message text
-    """
-    try:
-        # Send typing indicator
-        await context.bot.send_chat_action(chat_id=chat_id, action="typing")
-
-        session_manager = get_session_manager()
-        history = session_manager.get_history(chat_id)
-
-        assistant_message = ""
-        images = []
-
-        # Choose between CLI and SDK based on configuration
-        if config.use_cli:
-            # Use Claude CLI (always bypass mode)
-            # CLI handles conversation history internally via --continue flag
-            logger.info("Using Claude CLI mode with bypass permissions")
-            claude_manager = await get_claude_manager()
-            assistant_message = await claude_manager.send_prompt(text, chat_id)
-        else:
-            # Use SDK with permission mode
-            # SDK should receive structured messages, not text-prepended history
-            if config.permission_mode == 'interactive':
-                logger.info("Using Claude SDK mode with interactive permissions")
-                assistant_message, images = await query_claude_with_permissions(text, history, update, context)
-            else:
-                logger.info("Using Claude SDK mode with bypass permissions")
-                assistant_message, images = await query_claude_bypass(text, history)
-
-        assistant_message = assistant_message.strip()
-
-        # Add messages to history
-        session_manager.add_message(chat_id, "user", text)
-        session_manager.add_message(chat_id, "assistant", assistant_message)
-
-        # Send images first if any (from Claude's base64/URL responses)
-        for image in images:
-            await _send_image(update, image)
-
-        # Extract and send any image file paths mentioned by Claude
-        if assistant_message:
-            image_paths = extract_image_paths(assistant_message)
-            for img_path in image_paths:
-                try:
-                    await send_image_from_path(update, context, img_path)
-                except Exception as img_error:
-                    logger.error(f"Error auto-sending image {img_path}: {img_error}")
-
-        # Send response to user
-        if assistant_message:
-            await _send_text_chunks(update, assistant_message)
-        else:
-            if not images:
-                await update.message.reply_text(ERROR_MESSAGES['no_text_response'])
-
-    except Exception as e:
-        logger.error(f"Error processing text message: {e}", exc_info=True)
-        await update.message.reply_text(
-            f"❌ An error occurred while processing your request.\n"
-            f"Error: {str(e)}"
-        )
+    await _respond(update, context, chat_id, text)
 
 
 async def _handle_photo_message(
@@ -148,16 +181,13 @@ async def _handle_photo_message(
         photo_file = await photo[-1].get_file()
         photo_bytes = await photo_file.download_as_bytearray()
 
-        # Encode to base64 for Claude
-        photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
-
         # Get caption as text
         text = update.message.caption or "What's in this image?"
 
-        await _process_with_image(update, context, chat_id, text, photo_base64)
+        await _respond(update, context, chat_id, text, Attachment('image', photo_bytes))
 
     except Exception as e:
-        logger.error(f"Error processing photo: {e}", exc_info=True)
+        logger.error("Error processing photo: %s", e, exc_info=True)
         await update.message.reply_text(f"❌ Error processing image: {str(e)}")
 
 
@@ -187,210 +217,207 @@ async def _handle_document_message(
         # Get caption as text
         text = update.message.caption or f"Analyze this file: {file_name}"
 
-        # Check if it's an image file sent as document
-        if mime_type and mime_type.startswith('image/'):
-            file_base64 = base64.b64encode(file_bytes).decode('utf-8')
-            await _process_with_image(update, context, chat_id, text, file_base64)
-        else:
-            # Handle other file types (PDF, text, etc.)
-            await _process_with_file(update, context, chat_id, text, file_bytes, file_name, mime_type)
+        # Images sent as documents are handled like photos; other file
+        # types (PDF, text, etc.) are passed as file content. The content is
+        # checked first since clients often send images as octet-stream
+        is_image = _is_image(file_bytes) or bool(mime_type and mime_type.startswith('image/'))
+        kind = 'image' if is_image else 'file'
+        await _respond(update, context, chat_id, text, Attachment(kind, file_bytes, file_name, mime_type))
 
     except Exception as e:
-        logger.error(f"Error processing document: {e}", exc_info=True)
+        logger.error("Error processing document: %s", e, exc_info=True)
         await update.message.reply_text(f"❌ Error processing file: {str(e)}")
 
 
-async def _process_with_image(
-    update: Update,
-    context: ContextTypes.DEFAULT_TYPE,
-    chat_id: int,
-    text: str,
-    photo_base64: str
-):
+def _is_image(data: bytes) -> bool:
     """
-    Process a message with an image.
+    Check whether file content starts with a known image signature.
 
     Args:
-        update: Telegram update object
-        context: Telegram context object
-        chat_id: Telegram chat ID
-        text: Message text
-        photo_base64: Base64-encoded image data
+        data: File content
+
+    Returns:
+        True if the content is a PNG, JPEG, GIF or WebP image
     """
-    try:
-        # Send typing indicator
-        await context.bot.send_chat_action(chat_id=chat_id, action="typing")
+    return data.startswith(_IMAGE_SIGNATURES) or (data[:4] == b'RIFF' and data[8:12] == b'WEBP')
 
-        # Save image temporarily so Claude can access it
-        temp_dir = tempfile.gettempdir()
-        temp_image_path = os.path.join(temp_dir, f"telegram_image_{chat_id}.jpg")
 
-        # Decode and save the image
-        image_data = base64.b64decode(photo_base64)
-        with open(temp_image_path, 'wb') as f:
-            f.write(image_data)
+async def _build_prompt(chat_id: int, text: str, attachment: Optional[Attachment]) -> Tuple[str, str]:
+    """
+    Build the prompt for Claude and the user entry stored in history.
 
-        session_manager = get_session_manager()
-        history = session_manager.get_history(chat_id)
+    Image attachments are saved to a per-chat temp file that Claude reads,
+    so this must run under the chat's lock.
+
+    Args:
+        chat_id: Telegram chat ID
+        text: Message text or caption
+        attachment: Attached file, if any
+
+    Returns:
+        Tuple of (prompt, history entry)
+    """
+    if attachment is None:
+        return text, text
+
+    if attachment.kind == 'image':
+        # Save image temporarily (off the event loop) so Claude can access it
+        temp_image_path = os.path.join(_TEMP_DIR, f"telegram_image_{chat_id}.jpg")
+        await asyncio.to_thread(_write_bytes, temp_image_path, attachment.data)
 
-        # Build prompt with image reference
-        full_prompt = (
+        prompt = (
             f"{text}\n\n"
             f"User has sent an image saved at: {temp_image_path}\n"
             f"Please analyze this image and respond to the user's request."
         )
+        return prompt, f"[Image] {text}"
+
+    # Try to extract text content from file
+    file_name = attachment.name
+    mime_type = attachment.mime_type
+    if mime_type == 'application/pdf':
+        file_content = f"[PDF file: {file_name}]"
+    elif mime_type and mime_type.startswith('text/'):
+        # Text files
+        try:
+            file_content = attachment.data.decode('utf-8')
+        except UnicodeDecodeError:
+            file_content = f"[Text file: {file_name} - unable to decode]"
+    else:
+        file_content = f"[File: {file_name}, Type: {mime_type}]"
 
-        assistant_message = ""
-        images = []
-
-        # Choose between CLI and SDK based on configuration
-        if config.use_cli:
-            # Use Claude CLI (always bypass mode)
-            # CLI handles conversation history internally via --continue flag
-            logger.info("Using Claude CLI mode for image processing with bypass permissions")
-            claude_manager = await get_claude_manager()
-            assistant_message = await claude_manager.send_prompt(full_prompt, chat_id)
-        else:
-            # Use SDK with permission mode
-            # SDK should receive structured messages, not text-prepended history
-            if config.permission_mode == 'interactive':
-                logger.info("Using Claude SDK mode for image processing with interactive permissions")
-                assistant_message, images = await query_claude_with_permissions(full_prompt, history, update, context)
-            else:
-                logger.info("Using Claude SDK mode for image processing with bypass permissions")
-                assistant_message, images = await query_claude_bypass(full_prompt, history)
-
-        assistant_message = assistant_message.strip()
-
-        # Add to history
-        session_manager.add_message(chat_id, "user", f"[Image] {text}")
-        session_manager.add_message(chat_id, "assistant", assistant_message)
-
-        # Send images first if any
-        for image in images:
-            await _send_image(update, image)
-
-        # Send response
-        if assistant_message:
-            await _send_text_chunks(update, assistant_message)
-        else:
-            if not images:
-                await update.message.reply_text(ERROR_MESSAGES['no_response'])
+    prompt = f"{text}\n\nFile content:\n{file_content[:4000]}"
+    return prompt, f"[File: {file_name}] {text}"
 
-    except Exception as e:
-        logger.error(f"Error processing image: {e}", exc_info=True)
-        await update.message.reply_text(f"❌ Error processing image: {str(e)}")
 
+async def _query_claude(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: int,
+    prompt: str,
+    history: List[dict]
+) -> Tuple[str, List[dict]]:
+    """
+    Send a prompt to Claude using the configured mode.
+
+    Args:
+        update: Telegram update object
+        context: Telegram context object
+        chat_id: Telegram chat ID
+        prompt: Prompt to send
+        history: Snapshot of the chat's conversation history
 
-async def _process_with_file(
+    Returns:
+        Tuple of (response text, list of images)
+    """
+    if config.use_cli:
+        # Use Claude CLI (always bypass mode)
+        # CLI handles conversation history internally via --continue flag
+        logger.info("Using Claude CLI mode with bypass permissions")
+        claude_manager = await get_claude_manager()
+        return await claude_manager.send_prompt(prompt, chat_id), []
+
+    # Use SDK with permission mode
+    # SDK should receive structured messages, not text-prepended history
+    if config.permission_mode == 'interactive':
+        logger.info("Using Claude SDK mode with interactive permissions")
+        return await query_claude_with_permissions(prompt, history, update, context)
+
+    logger.info("Using Claude SDK mode with bypass permissions")
+    return await query_claude_bypass(prompt, history)
+
+
+async def _respond(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
     chat_id: int,
     text: str,
-    file_bytes: bytes,
-    file_name: str,
-    mime_type: str
+    attachment: Optional[Attachment] = None
 ):
     """
-    Process a message with a file (PDF, text, etc.).
+    Run a Claude turn for a message and send the reply.
 
     Args:
         update: Telegram update object
         context: Telegram context object
         chat_id: Telegram chat ID
-        text: Message text
-        file_bytes: File content as bytes
-        file_name: Name of the file
-        mime_type: MIME type of the file
+        text: Message text or caption
+        attachment: Attached image or file, if any
     """
+    kind = attachment.kind if attachment else None
     try:
         # Send typing indicator
         await context.bot.send_chat_action(chat_id=chat_id, action="typing")
 
-        # Try to extract text content from file
-        file_content = ""
-
-        if mime_type == 'application/pdf':
-            file_content = f"[PDF file: {file_name}]"
-        elif mime_type and mime_type.startswith('text/'):
-            # Text files
+        session_manager = get_session_manager()
+        async with session_manager.get_lock(chat_id):
+            prompt, history_entry = await _build_prompt(chat_id, text, attachment)
+
+            # Snapshot history (size-bounded) so the query sees a stable view
+            history = await session_manager.get_context(chat_id)
+
+            assistant_message, images = await _query_claude(update, context, chat_id, prompt, history)
+            assistant_message = assistant_message.strip()
+
+            # Add messages to history
+            await session_manager.add_message(chat_id, "user", history_entry)
+            await session_manager.add_message(chat_id, "assistant", assistant_message)
+
+        # Send images first if any (from Claude's base64/URL responses), then
+        # any image file paths mentioned by Claude. Paths are skipped for
+        # attachments, whose replies tend to mention the uploaded file itself.
+        # Images are decoded and read concurrently, then sent one at a time
+        # in the order Claude listed them.
+        loads = [_load_image(image) for image in images]
+        if assistant_message and attachment is None:
+            loads.extend(load_image_from_path(img_path) for img_path in extract_image_paths(assistant_message))
+
+        photos = []
+        for i, photo in enumerate(await asyncio.gather(*loads, return_exceptions=True)):
+            if isinstance(photo, Exception):
+                logger.error("Error loading image: %s", photo)
+            elif photo is not None:
+                # Image files Claude mentioned are captioned with their name
+                photos.append((photo, f"📷 {photo.filename}" if i >= len(images) else None))
+
+        if photos:
+            await context.bot.send_chat_action(chat_id=chat_id, action="upload_photo")
+        for photo, caption in photos:
             try:
-                file_content = file_bytes.decode('utf-8')
-            except:
-                file_content = f"[Text file: {file_name} - unable to decode]"
-        else:
-            file_content = f"[File: {file_name}, Type: {mime_type}]"
+                await update.message.reply_photo(photo=photo, caption=caption)
+            except Exception as img_error:
+                logger.error("Error sending image: %s", img_error)
 
-        session_manager = get_session_manager()
-        history = session_manager.get_history(chat_id)
-
-        # Build prompt with file content
-        full_prompt = f"{text}\n\nFile content:\n{file_content[:4000]}"
-
-        assistant_message = ""
-        images = []
-
-        # Choose between CLI and SDK based on configuration
-        if config.use_cli:
-            # Use Claude CLI (always bypass mode)
-            # CLI handles conversation history internally via --continue flag
-            logger.info("Using Claude CLI mode for file processing with bypass permissions")
-            claude_manager = await get_claude_manager()
-            assistant_message = await claude_manager.send_prompt(full_prompt, chat_id)
-        else:
-            # Use SDK with permission mode
-            # SDK should receive structured messages, not text-prepended history
-            if config.permission_mode == 'interactive':
-                logger.info("Using Claude SDK mode for file processing with interactive permissions")
-                assistant_message, images = await query_claude_with_permissions(full_prompt, history, update, context)
-            else:
-                logger.info("Using Claude SDK mode for file processing with bypass permissions")
-                assistant_message, images = await query_claude_bypass(full_prompt, history)
-
-        assistant_message = assistant_message.strip()
-
-        # Add to history
-        session_manager.add_message(chat_id, "user", f"[File: {file_name}] {text}")
-        session_manager.add_message(chat_id, "assistant", assistant_message)
-
-        # Send images first if any
-        for image in images:
-            await _send_image(update, image)
-
-        # Send response
+        # Send response to user
         if assistant_message:
             await _send_text_chunks(update, assistant_message)
-        else:
-            if not images:
-                await update.message.reply_text(ERROR_MESSAGES['no_response'])
+        elif not images:
+            await update.message.reply_text(
+                ERROR_MESSAGES['no_text_response' if attachment is None else 'no_response']
+            )
 
     except Exception as e:
-        logger.error(f"Error processing file: {e}", exc_info=True)
-        await update.message.reply_text(f"❌ Error processing file: {str(e)}")
-
-
+        logger.error("Error processing %s message: %s", kind or 'text', e, exc_info=True)
+        await update.message.reply_text(_ERROR_REPLIES[kind].format(error=str(e)))
 
 
-async def _send_image(update: Update, image: dict):
+async def _load_image(image: dict) -> Optional[Union[InputFile, str]]:
     """
-    Send an image to Telegram.
+    Get a sendable photo for an image from Claude's response.
 
     Args:
-        update: Telegram update object
         image: Image dictionary with either 'data' or 'url'
+
+    Returns:
+        InputFile for base64 data, the URL for URL images, or None
     """
-    try:
-        if 'data' in image:
-            # Base64 encoded image
-            image_data = base64.b64decode(image['data'])
-            photo = BytesIO(image_data)
-            photo.name = f"image.{image['media_type'].split('/')[-1]}"
-            await update.message.reply_photo(photo=photo)
-        elif 'url' in image:
-            # URL image
-            await update.message.reply_photo(photo=image['url'])
-    except Exception as img_error:
-        logger.error(f"Error sending image: {img_error}")
+    if 'data' in image:
+        # Base64 encoded image, decoded off the event loop so a multi-MB
+        # image doesn't stall other chats. The bytes are sent as-is rather
+        # than wrapped in a BytesIO that PTB would read back into a copy
+        image_data = await asyncio.to_thread(base64.b64decode, image['data'])
+        return InputFile(image_data, filename=f"image.{image['media_type'].split('/')[-1]}")
+    return image.get('url')
 
 
 async def _send_text_chunks(update: Update, text: str):
@@ -406,7 +433,25 @@ async def _send_text_chunks(update: Update, text: str):
         try:
             await update.message.reply_text(chunk)
         except Exception as send_error:
-            logger.error(f"Error sending chunk: {send_error}")
-            # If chunk is still too long, split it further by characters
-            for i in range(0, len(chunk), config.max_message_length):
-                await update.message.reply_text(chunk[i:i+config.max_message_length])
+            logger.error("Error sending chunk: %s", send_error)
+            # Telegram counts UTF-16 code units, so a chunk full of emoji can
+            # be too long despite fitting in characters; halves always fit
+            for part in split_message(chunk, config.max_message_length // 2):
+                await update.message.reply_text(part)
+
+
+def _write_bytes(path: str, data: bytes) -> None:
+    """
+    Atomically write data to a file (blocking; run it in a worker thread).
+
+    The data goes to a temporary file that is then renamed over the target,
+    so readers never see a half-written file.
+
+    Args:
+        path: Destination file path
+        data: Bytes to write
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
@@ -12,6 +12,22 @@ from ..permission_manager import get_permission_manager
 logger = logging.getLogger(__name__)
 
 
+def _make_keyboard(request_id: str) -> InlineKeyboardMarkup:
+    """
+    Build the approve/deny buttons for a permission request.
+
+    Args:
+        request_id: Permission request ID
+
+    Returns:
+        Inline keyboard with approve and deny buttons
+    """
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Approve", callback_data=f"approve_{request_id}"),
+        InlineKeyboardButton("❌ Deny", callback_data=f"deny_{request_id}")
+    ]])
+
+
 async def send_permission_request(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
@@ -44,17 +60,9 @@ async def send_permission_request(
         f"Do you want to allow this action?"
     )
 
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Approve", callback_data=f"approve_{request_id}"),
-            InlineKeyboardButton("❌ Deny", callback_data=f"deny_{request_id}")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     message = await update.message.reply_text(
         message_text,
-        reply_markup=reply_markup,
+        reply_markup=_make_keyboard(request_id),
         parse_mode='Markdown'
     )
 
@@ -72,12 +80,12 @@ async def handle_permission_callback(update: Update, context: ContextTypes.DEFAU
     query = update.callback_query
     await query.answer()
 
-    callback_data = query.data
+    # Callback data is "<action>_<request_id>"
+    action, _, request_id = query.data.partition("_")
     permission_manager = get_permission_manager()
 
     try:
-        if callback_data.startswith("approve_"):
-            request_id = callback_data.replace("approve_", "")
+        if action == "approve":
             request = permission_manager.get_request(request_id)
 
             if request:
@@ -91,8 +99,7 @@ async def handle_permission_callback(update: Update, context: ContextTypes.DEFAU
             else:
                 await query.edit_message_text("⚠️ Permission request expired or not found.")
 
-        elif callback_data.startswith("deny_"):
-            request_id = callback_data.replace("deny_", "")
+        elif action == "deny":
             request = permission_manager.get_request(request_id)
 
             if request:
@@ -107,5 +114,5 @@ async def handle_permission_callback(update: Update, context: ContextTypes.DEFAU
                 await query.edit_message_text("⚠️ Permission request expired or not found.")
 
     except Exception as e:
-        logger.error(f"Error handling permission callback: {e}", exc_info=True)
+        logger.error("Error handling permission callback: %s", e, exc_info=True)
         await query.edit_message_text(f"❌ Error processing your response: {str(e)}")
@@ -3,8 +3,9 @@ Interactive SDK handler with permission approvals via Telegram.
 Handles Claude SDK queries with user approval for tool usage.
 """
 
+import json
 import logging
-from typing import List, Optional, Any
+from typing import Any, Awaitable, Callable, List, Optional
 from telegram import Update
 from telegram.ext import ContextTypes
 
@@ -19,10 +20,97 @@ if not config.use_cli:
     try:
         from claude_agent_sdk import query
         from claude_agent_sdk.types import ClaudeAgentOptions
+
+        # Options are identical for every query, so build them once
+        BYPASS_OPTIONS = ClaudeAgentOptions(permission_mode='bypassPermissions')
+        ASK_OPTIONS = ClaudeAgentOptions(permission_mode='ask')
     except ImportError:
         logger.warning("Claude SDK not installed. SDK mode will not work.")
 
 
+def _add_text(content: Any, parts: List[str], images: List[dict]) -> None:
+    """Collect a text content block."""
+    parts.append(content.text)
+
+
+def _add_image(content: Any, parts: List[str], images: List[dict]) -> None:
+    """Collect an image content block."""
+    source = getattr(content, 'source', None)
+    if source is None:
+        return
+
+    source_type = source.type
+    if source_type == 'base64':
+        images.append({
+            'data': source.data,
+            'media_type': source.media_type
+        })
+    elif source_type == 'url':
+        images.append({'url': source.url})
+
+
+# Content block type -> collector
+_CONTENT_HANDLERS = {
+    'text': _add_text,
+    'image': _add_image,
+}
+
+
+async def _collect_response(
+    prompt: str,
+    history: List[dict],
+    options: Any,
+    on_tool_use: Optional[Callable[[Any], Awaitable[Optional[str]]]] = None
+) -> tuple[str, List[dict]]:
+    """
+    Run a Claude SDK query and collect the streamed text and images.
+
+    Text is gathered in a list and joined once at the end, so long streamed
+    responses aren't built by repeated string concatenation.
+
+    Args:
+        prompt: The current prompt to send to Claude
+        history: Conversation history as list of {role, content} dicts
+        options: ClaudeAgentOptions for the query
+        on_tool_use: Optional callback for tool_use messages; returning a
+            message stops the query and appends that message to the response
+
+    Returns:
+        Tuple of (response text, list of images)
+    """
+    parts: List[str] = []
+    images: List[dict] = []
+
+    # Build messages array with history + current prompt; history entries are
+    # already {role, content} dicts, so they're passed through as-is
+    messages = [*history, {"role": "user", "content": prompt}]
+
+    async for message in query(messages=messages, options=options):
+        # Each attribute is looked up once per streamed message
+        result = getattr(message, 'result', None)
+        content_list = getattr(message, 'content', None)
+
+        # Handle text results
+        if result:
+            parts.append(str(result))
+
+        # Handle content blocks (list format)
+        elif isinstance(content_list, list):
+            for content in content_list:
+                handler = _CONTENT_HANDLERS.get(getattr(content, 'type', None))
+                if handler is not None:
+                    handler(content, parts, images)
+
+        # Handle tool use requests
+        elif on_tool_use is not None and getattr(message, 'type', None) == 'tool_use':
+            stop_message = await on_tool_use(message)
+            if stop_message:
+                parts.append(stop_message)
+                break
+
+    return "".join(parts), images
+
+
 async def query_claude_with_permissions(
     prompt: str,
     history: List[dict],
@@ -44,82 +132,54 @@ async def query_claude_with_permissions(
     Returns:
         Tuple of (response text, list of images)
     """
-    assistant_message = ""
-    images = []
     permission_manager = get_permission_manager()
 
-    # Build messages array with history + current prompt
-    messages = []
-    for msg in history:
-        messages.append({"role": msg["role"], "content": msg["content"]})
-    messages.append({"role": "user", "content": prompt})
+    async def ask_permission(message: Any) -> Optional[str]:
+        """Ask the user to approve a tool use; return a stop message if denied."""
+        tool_name = getattr(message, 'name', 'unknown')
+        tool_input = getattr(message, 'input', None)
+        if tool_input is None:
+            tool_input = ''
+        elif not isinstance(tool_input, str):
+            # Tool inputs are usually dicts; JSON reads better than their repr
+            tool_input = json.dumps(tool_input, ensure_ascii=False, default=str)
+
+        # The request is cleaned up however this block exits, including when
+        # sending the prompt fails or the query is cancelled mid-wait
+        async with permission_manager.request(tool_name, tool_input) as request_id:
+            # Send permission request to user
+            message_id = await send_permission_request(
+                update, context, request_id, tool_name, tool_input
+            )
+            permission_manager.set_message_id(request_id, message_id)
+
+            # Wait for user approval
+            approved = await permission_manager.wait_for_approval(request_id)
+
+        if approved:
+            logger.info("Tool %s approved, continuing execution", tool_name)
+            # The SDK will continue with the tool execution
+            return None
+
+        logger.info("Tool %s denied by user", tool_name)
+        return f"\n\n❌ Tool '{tool_name}' was denied. Stopping execution."
 
     # Determine permission mode
     if config.permission_mode == 'bypass':
         # Use bypassPermissions mode to auto-approve all tool uses
-        options = ClaudeAgentOptions(permission_mode='bypassPermissions')
+        options = BYPASS_OPTIONS
+        on_tool_use = None
     else:
         # Use interactive mode - we'll handle permissions manually
-        options = ClaudeAgentOptions(permission_mode='ask')
+        options = ASK_OPTIONS
+        on_tool_use = ask_permission
 
     try:
-        async for message in query(messages=messages, options=options):
-            # Handle text results
-            if hasattr(message, 'result') and message.result:
-                assistant_message += str(message.result)
-
-            # Handle content blocks (list format)
-            elif hasattr(message, 'content') and isinstance(message.content, list):
-                for content in message.content:
-                    if hasattr(content, 'type'):
-                        if content.type == 'text':
-                            assistant_message += content.text
-                        elif content.type == 'image':
-                            # Handle image content
-                            if hasattr(content, 'source'):
-                                if content.source.type == 'base64':
-                                    images.append({
-                                        'data': content.source.data,
-                                        'media_type': content.source.media_type
-                                    })
-                                elif content.source.type == 'url':
-                                    images.append({'url': content.source.url})
-
-            # Handle tool use requests in interactive mode
-            elif config.permission_mode == 'interactive' and hasattr(message, 'type') and message.type == 'tool_use':
-                tool_name = message.name if hasattr(message, 'name') else 'unknown'
-                tool_input = str(message.input) if hasattr(message, 'input') else ''
-
-                # Create permission request
-                request_id = permission_manager.create_request(tool_name, tool_input)
-
-                # Send permission request to user
-                message_id = await send_permission_request(
-                    update, context, request_id, tool_name, tool_input
-                )
-                permission_manager.set_message_id(request_id, message_id)
-
-                # Wait for user approval
-                approved = await permission_manager.wait_for_approval(request_id)
-
-                if approved:
-                    logger.info(f"Tool {tool_name} approved, continuing execution")
-                    # The SDK will continue with the tool execution
-                else:
-                    logger.info(f"Tool {tool_name} denied by user")
-                    # Clean up and stop processing
-                    permission_manager.cleanup_request(request_id)
-                    assistant_message += f"\n\n❌ Tool '{tool_name}' was denied. Stopping execution."
-                    break
-
-                permission_manager.cleanup_request(request_id)
-
+        return await _collect_response(prompt, history, options, on_tool_use)
     except Exception as e:
-        logger.error(f"Error during Claude SDK query: {e}", exc_info=True)
+        logger.error("Error during Claude SDK query: %s", e, exc_info=True)
         raise
 
-    return assistant_message, images
-
 
 async def query_claude_bypass(prompt: str, history: List[dict]) -> tuple[str, List[dict]]:
     """
@@ -132,37 +192,5 @@ async def query_claude_bypass(prompt: str, history: List[dict]) -> tuple[str, Li
     Returns:
         Tuple of (response text, list of images)
     """
-    assistant_message = ""
-    images = []
-
-    # Build messages array with history + current prompt
-    messages = []
-    for msg in history:
-        messages.append({"role": msg["role"], "content": msg["content"]})
-    messages.append({"role": "user", "content": prompt})
-
     # Use bypassPermissions mode to auto-approve all tool uses
-    options = ClaudeAgentOptions(permission_mode='bypassPermissions')
-
-    async for message in query(messages=messages, options=options):
-        # Only process TextResult messages with actual content
-        if hasattr(message, 'result') and message.result:
-            assistant_message += str(message.result)
-        # Check if message has content blocks (list format)
-        elif hasattr(message, 'content') and isinstance(message.content, list):
-            for content in message.content:
-                if hasattr(content, 'type'):
-                    if content.type == 'text':
-                        assistant_message += content.text
-                    elif content.type == 'image':
-                        # Handle image content
-                        if hasattr(content, 'source'):
-                            if content.source.type == 'base64':
-                                images.append({
-                                    'data': content.source.data,
-                                    'media_type': content.source.media_type
-                                })
-                            elif content.source.type == 'url':
-                                images.append({'url': content.source.url})
-
-    return assistant_message, images
+    return await _collect_response(prompt, history, BYPASS_OPTIONS)
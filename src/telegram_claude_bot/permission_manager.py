@@ -3,11 +3,13 @@ Permission manager for handling Claude tool usage approvals via Telegram.
 Allows users to approve or deny tool usage through inline buttons.
 """
 
+import time
 import asyncio
 import logging
-from typing import Optional, Dict
+import itertools
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Dict
 from dataclasses import dataclass
-from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +19,7 @@ class PermissionRequest:
     """Represents a permission request for tool usage."""
     tool_name: str
     tool_input: str
-    timestamp: datetime
+    timestamp: float  # time.monotonic() at creation
     message_id: Optional[int] = None
     approved: Optional[bool] = None
     response_event: asyncio.Event = None
@@ -33,6 +35,9 @@ class PermissionManager:
     def __init__(self):
         """Initialize the permission manager."""
         self.pending_requests: Dict[str, PermissionRequest] = {}
+        # Request IDs are short and never repeat, unlike timestamps, and keep
+        # the button callback data well under Telegram's 64-byte limit
+        self._request_ids = itertools.count(1)
         self.timeout = 300.0  # 5 minutes default timeout
 
     def create_request(self, tool_name: str, tool_input: str) -> str:
@@ -46,16 +51,37 @@ class PermissionManager:
         Returns:
             Request ID
         """
-        request_id = f"{tool_name}_{datetime.now().timestamp()}"
+        request_id = str(next(self._request_ids))
         request = PermissionRequest(
             tool_name=tool_name,
             tool_input=tool_input,
-            timestamp=datetime.now()
+            timestamp=time.monotonic()
         )
         self.pending_requests[request_id] = request
-        logger.info(f"Created permission request: {request_id}")
+        logger.info("Created permission request: %s", request_id)
         return request_id
 
+    @asynccontextmanager
+    async def request(self, tool_name: str, tool_input: str) -> AsyncIterator[str]:
+        """
+        Create a permission request that is cleaned up on any exit path.
+
+        Args:
+            tool_name: Name of the tool requesting permission
+            tool_input: Input parameters for the tool
+
+        Yields:
+            Request ID
+        """
+        request_id = self.create_request(tool_name, tool_input)
+        try:
+            yield request_id
+        finally:
+            request = self.pending_requests.pop(request_id, None)
+            if request is not None:
+                # Release anything still waiting on this request
+                request.response_event.set()
+
     async def wait_for_approval(self, request_id: str, timeout: Optional[float] = None) -> bool:
         """
         Wait for user approval on a permission request.
@@ -68,7 +94,7 @@ class PermissionManager:
             True if approved, False if denied or timeout
         """
         if request_id not in self.pending_requests:
-            logger.error(f"Request {request_id} not found")
+            logger.error("Request %s not found", request_id)
             return False
 
         request = self.pending_requests[request_id]
@@ -79,7 +105,7 @@ class PermissionManager:
             await asyncio.wait_for(request.response_event.wait(), timeout=timeout)
             return request.approved or False
         except asyncio.TimeoutError:
-            logger.warning(f"Permission request {request_id} timed out")
+            logger.warning("Permission request %s timed out", request_id)
             self.pending_requests.pop(request_id, None)
             return False
 
@@ -94,13 +120,13 @@ class PermissionManager:
             True if successful, False otherwise
         """
         if request_id not in self.pending_requests:
-            logger.error(f"Request {request_id} not found")
+            logger.error("Request %s not found", request_id)
             return False
 
         request = self.pending_requests[request_id]
         request.approved = True
         request.response_event.set()
-        logger.info(f"Approved permission request: {request_id}")
+        logger.info("Approved permission request: %s", request_id)
         return True
 
     def deny_request(self, request_id: str) -> bool:
@@ -114,13 +140,13 @@ class PermissionManager:
             True if successful, False otherwise
         """
         if request_id not in self.pending_requests:
-            logger.error(f"Request {request_id} not found")
+            logger.error("Request %s not found", request_id)
             return False
 
         request = self.pending_requests[request_id]
         request.approved = False
         request.response_event.set()
-        logger.info(f"Denied permission request: {request_id}")
+        logger.info("Denied permission request: %s", request_id)
         return True
 
     def get_request(self, request_id: str) -> Optional[PermissionRequest]:
@@ -155,7 +181,7 @@ class PermissionManager:
         """
         if request_id in self.pending_requests:
             self.pending_requests.pop(request_id)
-            logger.info(f"Cleaned up permission request: {request_id}")
+            logger.info("Cleaned up permission request: %s", request_id)
 
 
 # Global permission manager instance
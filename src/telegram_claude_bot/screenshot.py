@@ -5,6 +5,12 @@ Supports macOS, Linux, and Windows platforms.
 
 import os
 import sys
+import time
+import zlib
+import ctypes
+import shutil
+import struct
+import contextlib
 import logging
 import asyncio
 import tempfile
@@ -12,6 +18,42 @@ from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+# mss is optional; it captures in-process instead of spawning a screenshot tool
+try:
+    import mss
+except ImportError:
+    mss = None
+
+# Linux screenshot tools found on PATH, in order of preference; looked up once
+# so a missing tool doesn't cost a failed spawn on every capture
+_LINUX_TOOLS = tuple(
+    command for command in (('scrot',), ('import', '-window', 'root'))
+    if shutil.which(command[0])
+) if sys.platform == 'linux' else ()
+
+# Win32 constants for GDI screen capture
+_SM_CXSCREEN = 0
+_SM_CYSCREEN = 1
+_SRCCOPY = 0x00CC0020
+_DIB_RGB_COLORS = 0
+
+
+class _BITMAPINFOHEADER(ctypes.Structure):
+    """Win32 BITMAPINFOHEADER, describing the pixel format GetDIBits returns."""
+    _fields_ = [
+        ('biSize', ctypes.c_uint32),
+        ('biWidth', ctypes.c_int32),
+        ('biHeight', ctypes.c_int32),
+        ('biPlanes', ctypes.c_uint16),
+        ('biBitCount', ctypes.c_uint16),
+        ('biCompression', ctypes.c_uint32),
+        ('biSizeImage', ctypes.c_uint32),
+        ('biXPelsPerMeter', ctypes.c_int32),
+        ('biYPelsPerMeter', ctypes.c_int32),
+        ('biClrUsed', ctypes.c_uint32),
+        ('biClrImportant', ctypes.c_uint32),
+    ]
+
 
 async def capture_screenshot(chat_id: int) -> Optional[str]:
     """
@@ -23,34 +65,61 @@ async def capture_screenshot(chat_id: int) -> Optional[str]:
     Returns:
         Path to the screenshot file, or None if capture failed
     """
+    screenshot_path = None
     try:
-        # Create a temporary file for the screenshot
-        temp_dir = tempfile.gettempdir()
-        timestamp = int(asyncio.get_event_loop().time() * 1000)
-        screenshot_path = os.path.join(temp_dir, f"screenshot_{chat_id}_{timestamp}.png")
-
-        # Platform-specific screenshot capture
-        if sys.platform == 'darwin':
-            # macOS screenshot command
-            success = await _capture_macos(screenshot_path)
-        elif sys.platform == 'linux':
-            # Linux screenshot using scrot or import (ImageMagick)
-            success = await _capture_linux(screenshot_path)
-        elif sys.platform == 'win32':
-            # Windows screenshot using PowerShell
-            success = await _capture_windows(screenshot_path)
-        else:
-            logger.error(f"Unsupported platform: {sys.platform}")
+        if _capture is None:
+            logger.error("Unsupported platform: %s", sys.platform)
             return None
 
-        if success and os.path.exists(screenshot_path):
+        # Create a temporary file for the screenshot
+        screenshot_path = os.path.join(
+            _TEMP_DIR, f"screenshot_{chat_id}_{time.monotonic_ns()}.png"
+        )
+
+        if await _capture(screenshot_path) and os.path.exists(screenshot_path):
             return screenshot_path
-        else:
-            return None
 
     except Exception as e:
-        logger.error(f"Error capturing screenshot: {e}", exc_info=True)
-        return None
+        logger.error("Error capturing screenshot: %s", e, exc_info=True)
+
+    # Don't leave a partial file behind from a failed capture
+    if screenshot_path is not None:
+        with contextlib.suppress(OSError):
+            os.remove(screenshot_path)
+    return None
+
+
+async def _capture_mss(screenshot_path: str) -> bool:
+    """
+    Capture the primary monitor in-process with mss, if it's installed.
+
+    Args:
+        screenshot_path: Path to save the screenshot
+
+    Returns:
+        True if successful, False if mss is unavailable or capture failed
+    """
+    if mss is None:
+        return False
+
+    try:
+        await asyncio.to_thread(_grab_screen_mss, screenshot_path)
+        return True
+    except Exception as e:
+        logger.warning("mss screen capture failed (%s), falling back to screenshot tool", e)
+        return False
+
+
+def _grab_screen_mss(screenshot_path: str) -> None:
+    """
+    Save a PNG of the primary monitor using mss (blocking).
+
+    Args:
+        screenshot_path: Path to save the screenshot
+    """
+    # mss instances aren't shareable across threads, so each capture opens its own
+    with mss.mss() as sct:
+        sct.shot(mon=1, output=screenshot_path)
 
 
 async def _capture_macos(screenshot_path: str) -> bool:
@@ -63,16 +132,19 @@ async def _capture_macos(screenshot_path: str) -> bool:
     Returns:
         True if successful, False otherwise
     """
+    if await _capture_mss(screenshot_path):
+        return True
+
     try:
         process = await asyncio.create_subprocess_exec(
             'screencapture', '-x', screenshot_path,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
         )
-        await process.communicate()
+        await process.wait()
         return process.returncode == 0
     except Exception as e:
-        logger.error(f"macOS screenshot failed: {e}")
+        logger.error("macOS screenshot failed: %s", e)
         return False
 
 
@@ -86,40 +158,174 @@ async def _capture_linux(screenshot_path: str) -> bool:
     Returns:
         True if successful, False otherwise
     """
-    # Try scrot first
-    try:
-        process = await asyncio.create_subprocess_exec(
-            'scrot', screenshot_path,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        await process.communicate()
-        if process.returncode == 0:
-            return True
-    except FileNotFoundError:
-        pass
+    if await _capture_mss(screenshot_path):
+        return True
 
-    # Try ImageMagick's import command
-    try:
-        process = await asyncio.create_subprocess_exec(
-            'import', '-window', 'root', screenshot_path,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        await process.communicate()
-        return process.returncode == 0
-    except FileNotFoundError:
+    if not _LINUX_TOOLS:
         logger.error("Neither scrot nor ImageMagick found on Linux system")
         return False
-    except Exception as e:
-        logger.error(f"Linux screenshot failed: {e}")
-        return False
+
+    # scrot first, then ImageMagick's import command
+    for command in _LINUX_TOOLS:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command, screenshot_path,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            await process.wait()
+            if process.returncode == 0:
+                return True
+        except Exception as e:
+            logger.error("Linux screenshot with %s failed: %s", command[0], e)
+
+    return False
 
 
 async def _capture_windows(screenshot_path: str) -> bool:
     """
     Capture screenshot on Windows.
 
+    The screen is grabbed in-process through GDI; PowerShell, which takes
+    far longer to start than the capture itself, is only a fallback.
+
+    Args:
+        screenshot_path: Path to save the screenshot
+
+    Returns:
+        True if successful, False otherwise
+    """
+    try:
+        if await asyncio.to_thread(_grab_screen_gdi, screenshot_path):
+            return True
+        logger.warning("GDI screen capture failed, falling back to PowerShell")
+    except Exception as e:
+        logger.warning("GDI screen capture failed (%s), falling back to PowerShell", e)
+
+    return await _capture_windows_powershell(screenshot_path)
+
+
+def _grab_screen_gdi(screenshot_path: str) -> bool:
+    """
+    Capture the primary screen with Win32 GDI and save it as PNG (blocking).
+
+    Args:
+        screenshot_path: Path to save the screenshot
+
+    Returns:
+        True if successful, False otherwise
+    """
+    from ctypes import wintypes
+
+    # Private DLL handles, so setting argtypes doesn't affect ctypes.windll users
+    user32 = ctypes.WinDLL('user32')
+    gdi32 = ctypes.WinDLL('gdi32')
+    user32.GetDC.argtypes = [wintypes.HWND]
+    user32.GetDC.restype = wintypes.HDC
+    user32.ReleaseDC.argtypes = [wintypes.HWND, wintypes.HDC]
+    gdi32.CreateCompatibleDC.argtypes = [wintypes.HDC]
+    gdi32.CreateCompatibleDC.restype = wintypes.HDC
+    gdi32.CreateCompatibleBitmap.argtypes = [wintypes.HDC, ctypes.c_int, ctypes.c_int]
+    gdi32.CreateCompatibleBitmap.restype = wintypes.HBITMAP
+    gdi32.SelectObject.argtypes = [wintypes.HDC, wintypes.HGDIOBJ]
+    gdi32.SelectObject.restype = wintypes.HGDIOBJ
+    gdi32.BitBlt.argtypes = [
+        wintypes.HDC, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+        wintypes.HDC, ctypes.c_int, ctypes.c_int, wintypes.DWORD
+    ]
+    gdi32.GetDIBits.argtypes = [
+        wintypes.HDC, wintypes.HBITMAP, wintypes.UINT, wintypes.UINT,
+        ctypes.c_void_p, ctypes.c_void_p, wintypes.UINT
+    ]
+    gdi32.DeleteObject.argtypes = [wintypes.HGDIOBJ]
+    gdi32.DeleteDC.argtypes = [wintypes.HDC]
+
+    width = user32.GetSystemMetrics(_SM_CXSCREEN)
+    height = user32.GetSystemMetrics(_SM_CYSCREEN)
+
+    screen_dc = user32.GetDC(None)
+    memory_dc = gdi32.CreateCompatibleDC(screen_dc)
+    bitmap = gdi32.CreateCompatibleBitmap(screen_dc, width, height)
+    previous = gdi32.SelectObject(memory_dc, bitmap)
+    try:
+        if not gdi32.BitBlt(memory_dc, 0, 0, width, height, screen_dc, 0, 0, _SRCCOPY):
+            return False
+
+        # 32-bit BGRX pixels, rows top-down (negative height)
+        header = _BITMAPINFOHEADER(
+            ctypes.sizeof(_BITMAPINFOHEADER), width, -height, 1, 32, 0, 0, 0, 0, 0, 0
+        )
+        pixels = ctypes.create_string_buffer(width * height * 4)
+        rows = gdi32.GetDIBits(
+            memory_dc, bitmap, 0, height, pixels, ctypes.byref(header), _DIB_RGB_COLORS
+        )
+        if rows != height:
+            return False
+    finally:
+        gdi32.SelectObject(memory_dc, previous)
+        gdi32.DeleteObject(bitmap)
+        gdi32.DeleteDC(memory_dc)
+        user32.ReleaseDC(None, screen_dc)
+
+    with open(screenshot_path, 'wb') as f:
+        f.write(_encode_png(width, height, pixels.raw))
+    return True
+
+
+def _encode_png(width: int, height: int, bgrx: bytes) -> bytes:
+    """
+    Encode 32-bit BGRX pixels (rows top-down) as an RGB PNG.
+
+    Args:
+        width: Image width in pixels
+        height: Image height in pixels
+        bgrx: Pixel data, 4 bytes per pixel
+
+    Returns:
+        PNG file contents
+    """
+    # Reorder channels with extended slice assignment, which runs in C
+    rgb = bytearray(width * height * 3)
+    rgb[0::3] = bgrx[2::4]
+    rgb[1::3] = bgrx[1::4]
+    rgb[2::3] = bgrx[0::4]
+
+    # Each scanline is prefixed with filter type 0 (none)
+    stride = width * 3
+    raw = b''.join(
+        b'\x00' + rgb[offset:offset + stride] for offset in range(0, len(rgb), stride)
+    )
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        # Fast compression: screenshots are sent once, not stored
+        + chunk(b'IDAT', zlib.compress(raw, 1))
+        + chunk(b'IEND', b'')
+    )
+
+
+# Saves the primary screen to $env:SCREENSHOT_PATH; the path is passed through
+# the environment so it never has to be quoted into the script
+_POWERSHELL_SCRIPT = """
+Add-Type -AssemblyName System.Windows.Forms
+$screen = [System.Windows.Forms.Screen]::PrimaryScreen.Bounds
+$bitmap = New-Object System.Drawing.Bitmap $screen.Width, $screen.Height
+$graphics = [System.Drawing.Graphics]::FromImage($bitmap)
+$graphics.CopyFromScreen($screen.Location, [System.Drawing.Point]::Empty, $screen.Size)
+$bitmap.Save($env:SCREENSHOT_PATH, [System.Drawing.Imaging.ImageFormat]::Png)
+$graphics.Dispose()
+$bitmap.Dispose()
+"""
+
+
+async def _capture_windows_powershell(screenshot_path: str) -> bool:
+    """
+    Capture screenshot on Windows using PowerShell and System.Drawing.
+
     Args:
         screenshot_path: Path to save the screenshot
 
@@ -127,28 +333,31 @@ async def _capture_windows(screenshot_path: str) -> bool:
         True if successful, False otherwise
     """
     try:
-        ps_script = f"""
-        Add-Type -AssemblyName System.Windows.Forms
-        $screen = [System.Windows.Forms.Screen]::PrimaryScreen.Bounds
-        $bitmap = New-Object System.Drawing.Bitmap $screen.Width, $screen.Height
-        $graphics = [System.Drawing.Graphics]::FromImage($bitmap)
-        $graphics.CopyFromScreen($screen.Location, [System.Drawing.Point]::Empty, $screen.Size)
-        $bitmap.Save('{screenshot_path}', [System.Drawing.Imaging.ImageFormat]::Png)
-        $graphics.Dispose()
-        $bitmap.Dispose()
-        """
         process = await asyncio.create_subprocess_exec(
-            'powershell', '-Command', ps_script,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+            'powershell', '-NoProfile', '-NonInteractive', '-Command', _POWERSHELL_SCRIPT,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+            env={**os.environ, 'SCREENSHOT_PATH': screenshot_path}
         )
-        await process.communicate()
+        await process.wait()
         return process.returncode == 0
     except Exception as e:
-        logger.error(f"Windows screenshot failed: {e}")
+        logger.error("Windows screenshot failed: %s", e)
         return False
 
 
+# Platform-specific capture function, resolved once: mss when installed, else
+# screencapture on macOS or scrot/ImageMagick on Linux; GDI (PowerShell fallback) on Windows
+_capture = {
+    'darwin': _capture_macos,
+    'linux': _capture_linux,
+    'win32': _capture_windows,
+}.get(sys.platform)
+
+# Directory screenshots are saved to before being sent
+_TEMP_DIR = tempfile.gettempdir()
+
+
 def get_screenshot_error_message() -> str:
     """
     Get platform-specific error message for screenshot failures.
@@ -161,6 +370,7 @@ def get_screenshot_error_message() -> str:
     elif sys.platform == 'linux':
         return (
             "❌ Screenshot tool not found. Please install:\n"
+            "• mss: `pip install mss` or\n"
             "• scrot: `sudo apt install scrot` or\n"
             "• ImageMagick: `sudo apt install imagemagick`"
         )
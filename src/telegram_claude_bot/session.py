@@ -1,46 +1,254 @@
 """
 Session management for the Telegram Claude Bot.
-Handles conversation history for chats.
+Handles conversation history for chats, optionally persisted to disk as
+one append-only JSONL transcript per chat.
 """
 
+import os
+import json
+import asyncio
 import logging
-from typing import Dict, List
+import weakref
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional
 
 from .config import config
+from .claude_manager import get_claude_manager
+
+try:
+    import fcntl
+except ImportError:  # Windows: transcripts are written without file locks
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
+# Most recent messages always sent in full by get_context
+_KEEP_RECENT = 5
+# Stands in for the content of older messages trimmed by get_context
+_ARCHIVED = "[archived]"
+# A transcript is rewritten to its last max_history_length lines once it
+# holds this many times as many, so it doesn't grow without bound
+_COMPACT_FACTOR = 2
+
 
-async def _get_claude_manager_if_cli():
-    """Get Claude manager if in CLI mode, otherwise return None."""
-    if config.use_cli:
-        from .claude_manager import get_claude_manager
-        return await get_claude_manager()
-    return None
+@dataclass(frozen=True, slots=True)
+class Message:
+    """A single entry of a chat's conversation history."""
+    role: str  # 'user' or 'assistant'
+    content: str
+
+    def __getitem__(self, key: str) -> str:
+        """Allow dict-style access, e.g. message["role"]."""
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
 
 
 class SessionManager:
     """Manages conversation sessions and history for users."""
 
-    def __init__(self):
-        """Initialize the session manager."""
-        self.conversations: Dict[int, List[dict]] = {}
+    def __init__(self, history_dir: Optional[str] = None):
+        """
+        Initialize the session manager.
+
+        Args:
+            history_dir: Directory for per-chat JSONL transcripts; history is
+                kept in memory only if None
+        """
+        # Bounded per chat: appending past max_history_length drops the oldest message.
+        # Ordered least to most recently used, so the oldest chat is evicted first.
+        self.conversations: OrderedDict[int, Deque[Message]] = OrderedDict()
+        self.history_dir = os.path.expanduser(history_dir) if history_dir else None
+        if self.history_dir:
+            os.makedirs(self.history_dir, exist_ok=True)
+        # Lines in each loaded chat's transcript, to know when to compact it
+        self._transcript_lines: Dict[int, int] = {}
+        # Per-chat locks, held weakly so idle chats don't keep theirs alive
+        self._locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+
+    def get_lock(self, chat_id: int) -> asyncio.Lock:
+        """
+        Get the lock that serializes Claude turns for a chat.
+
+        Different chats get different locks, so only messages from the
+        same chat wait for each other.
+
+        Args:
+            chat_id: Telegram chat ID
+
+        Returns:
+            asyncio.Lock for the chat
+        """
+        lock = self._locks.get(chat_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[chat_id] = lock
+        return lock
 
-    def get_history(self, chat_id: int) -> List[dict]:
+    async def get_history(self, chat_id: int) -> Deque[Message]:
         """
         Get conversation history for a chat.
 
+        Once more than config.max_cached_chats chats are held, the least
+        recently used chat's history is dropped from memory; it's reloaded
+        from its transcript on next use if history_dir is set.
+
+        Args:
+            chat_id: Telegram chat ID
+
+        Returns:
+            Deque of messages, oldest first
+        """
+        history = self.conversations.get(chat_id)
+        if history is not None:
+            self.conversations.move_to_end(chat_id)
+            return history
+
+        if self.history_dir:
+            # Read off the event loop; the transcript may be large or locked
+            history = await asyncio.to_thread(self._load_history, chat_id)
+            if chat_id in self.conversations:
+                # Loaded by another task meanwhile
+                self.conversations.move_to_end(chat_id)
+                return self.conversations[chat_id]
+        else:
+            history = deque(maxlen=config.max_history_length)
+
+        self.conversations[chat_id] = history
+        while len(self.conversations) > config.max_cached_chats:
+            evicted_chat_id, _ = self.conversations.popitem(last=False)
+            self._transcript_lines.pop(evicted_chat_id, None)
+            logger.debug("Evicted history of least recently used chat %s", evicted_chat_id)
+        return history
+
+    async def get_context(self, chat_id: int) -> List[dict]:
+        """
+        Get a snapshot of a chat's history to send along with the next prompt.
+
+        When the history is over config.max_history_chars, the content of the
+        oldest messages is replaced with a placeholder until it fits. The
+        last few messages are always kept whole. The stored history is left
+        untouched.
+
+        Args:
+            chat_id: Telegram chat ID
+
+        Returns:
+            List of {role, content} dicts, oldest first, as the SDK expects
+        """
+        history = [
+            {"role": message.role, "content": message.content}
+            for message in await self.get_history(chat_id)
+        ]
+        total = sum(len(message["content"]) for message in history)
+
+        for i in range(len(history) - _KEEP_RECENT):
+            if total <= config.max_history_chars:
+                break
+            message = history[i]
+            total -= len(message["content"]) - len(_ARCHIVED)
+            message["content"] = _ARCHIVED
+
+        return history
+
+    def _history_path(self, chat_id: int) -> str:
+        """
+        Get the transcript file path for a chat.
+
+        Args:
+            chat_id: Telegram chat ID
+
+        Returns:
+            Path to the chat's JSONL transcript
+        """
+        return os.path.join(self.history_dir, f"{chat_id}.jsonl")
+
+    def _load_history(self, chat_id: int) -> Deque[Message]:
+        """
+        Load the most recent messages of a chat's transcript (blocking).
+
         Args:
             chat_id: Telegram chat ID
 
         Returns:
-            List of message dictionaries
+            Deque of messages, oldest first
+        """
+        history = deque(maxlen=config.max_history_length)
+        # Only the last max_history_length lines are kept
+        lines = deque(maxlen=config.max_history_length)
+        count = 0
+
+        try:
+            with open(self._history_path(chat_id), 'r', encoding='utf-8') as f:
+                for count, line in enumerate(f, 1):
+                    lines.append(line)
+                for line in lines:
+                    try:
+                        record = json.loads(line)
+                        history.append(Message(record["role"], record["content"]))
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning("Skipping corrupt transcript line for chat %s", chat_id)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error("Error loading transcript for chat %s: %s", chat_id, e)
+
+        self._transcript_lines[chat_id] = count
+        return history
+
+    def _append_to_transcript(self, chat_id: int, message: Message) -> None:
+        """
+        Append a message to a chat's transcript as one JSON line (blocking).
+
+        Once the transcript holds _COMPACT_FACTOR times max_history_length
+        lines, it's rewritten to keep only the last max_history_length.
+
+        Args:
+            chat_id: Telegram chat ID
+            message: Message to persist
+        """
+        record = {"role": message.role, "content": message.content}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        path = self._history_path(chat_id)
+        try:
+            with open(path, 'a+', encoding='utf-8') as f:
+                if fcntl is not None:
+                    # Keep lines whole if another process writes the same file
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                f.write(line)
+
+                count = self._transcript_lines.get(chat_id, 0) + 1
+                if count >= _COMPACT_FACTOR * config.max_history_length:
+                    # Rewrite from the file itself, under its lock, then swap
+                    # the compacted copy in atomically
+                    f.flush()
+                    f.seek(0)
+                    recent = deque(f, maxlen=config.max_history_length)
+                    with open(path + '.tmp', 'w', encoding='utf-8') as compacted:
+                        compacted.writelines(recent)
+                    os.replace(path + '.tmp', path)
+                    count = len(recent)
+                self._transcript_lines[chat_id] = count
+        except OSError as e:
+            logger.error("Error writing transcript for chat %s: %s", chat_id, e)
+
+    def _remove_transcript(self, chat_id: int) -> None:
+        """
+        Remove a chat's transcript, if any (blocking).
+
+        Args:
+            chat_id: Telegram chat ID
         """
-        if chat_id not in self.conversations:
-            self.conversations[chat_id] = []
-        return self.conversations[chat_id]
+        try:
+            os.remove(self._history_path(chat_id))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error("Error removing transcript for chat %s: %s", chat_id, e)
 
-    def add_message(self, chat_id: int, role: str, content: str) -> None:
+    async def add_message(self, chat_id: int, role: str, content: str) -> None:
         """
         Add a message to conversation history.
 
@@ -49,39 +257,41 @@ class SessionManager:
             role: Message role ('user' or 'assistant')
             content: Message content
         """
-        history = self.get_history(chat_id)
-        history.append({
-            "role": role,
-            "content": content
-        })
+        message = Message(role, content)
+        (await self.get_history(chat_id)).append(message)
+        if self.history_dir:
+            # flock may wait on another process, so keep it off the event loop
+            await asyncio.to_thread(self._append_to_transcript, chat_id, message)
 
-        # Keep history manageable
-        if len(history) > config.max_history_length:
-            self.conversations[chat_id] = history[-config.max_history_length:]
-
-    def clear_history(self, chat_id: int) -> None:
+    async def clear_history(self, chat_id: int) -> None:
         """
         Clear conversation history for a chat.
 
         Args:
             chat_id: Telegram chat ID
         """
-        self.conversations[chat_id] = []
-        logger.info(f"Cleared conversation history for chat {chat_id}")
+        self.conversations.pop(chat_id, None)
+        self._transcript_lines.pop(chat_id, None)
+        if self.history_dir:
+            await asyncio.to_thread(self._remove_transcript, chat_id)
+        logger.info("Cleared conversation history for chat %s", chat_id)
 
     async def clear_all(self, chat_id: int) -> None:
         """
         Clear both conversation history and session directory.
 
+        Waits for a turn in progress to finish first, so its messages aren't
+        added back to the history after it was cleared.
+
         Args:
             chat_id: Telegram chat ID
         """
-        self.clear_history(chat_id)
+        async with self.get_lock(chat_id):
+            await self.clear_history(chat_id)
         if config.use_cli:
             # Use the claude_manager's clear method instead of local session dir
-            claude_manager = await _get_claude_manager_if_cli()
-            if claude_manager:
-                claude_manager.clear_chat_session(chat_id)
+            claude_manager = await get_claude_manager()
+            await claude_manager.clear_chat_session(chat_id)
 
 
 # Global session manager instance
@@ -97,5 +307,5 @@ def get_session_manager() -> SessionManager:
     """
     global _session_manager
     if _session_manager is None:
-        _session_manager = SessionManager()
+        _session_manager = SessionManager(config.history_dir)
     return _session_manager
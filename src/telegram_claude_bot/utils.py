@@ -3,23 +3,27 @@ Utility functions for the Telegram Claude Bot.
 Contains reusable functions for message processing, image handling, etc.
 """
 
+import asyncio
 import os
 import re
 import logging
-from typing import List
-from telegram import Update
-from telegram.ext import ContextTypes
+from itertools import islice
+from typing import Iterable, List, Optional
+from telegram import InputFile
 
 logger = logging.getLogger(__name__)
 
 
-def split_message(text: str, max_length: int = 4000) -> List[str]:
+def split_message(text: str, max_length: int = 4096) -> List[str]:
     """
     Split long messages into chunks that fit Telegram's message size limit.
 
+    Chunks are packed as full as possible, breaking at a paragraph break,
+    then a line break, then a space, and only mid-word as a last resort.
+
     Args:
         text: The text to split
-        max_length: Maximum length per chunk (default: 4000)
+        max_length: Maximum length per chunk (default: 4096, Telegram's limit)
 
     Returns:
         List of message chunks
@@ -28,34 +32,45 @@ def split_message(text: str, max_length: int = 4000) -> List[str]:
         return [text]
 
     chunks = []
-    current_chunk = ""
-
-    lines = text.split('\n')
-
-    for line in lines:
-        # If a single line is longer than max_length, split it by characters
-        if len(line) > max_length:
-            # First, add any current chunk
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-                current_chunk = ""
-
-            # Split the long line into character chunks
-            for i in range(0, len(line), max_length):
-                chunks.append(line[i:i + max_length])
-        elif len(current_chunk) + len(line) + 1 > max_length:
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            current_chunk = line + '\n'
+    start = 0
+    # Don't break at a separator that would leave a chunk less than half full
+    min_cut = max_length // 2
+
+    while len(text) - start > max_length:
+        end = start + max_length
+        for separator in ('\n\n', '\n', ' '):
+            cut = text.rfind(separator, start + min_cut, end)
+            if cut != -1:
+                break
         else:
-            current_chunk += line + '\n'
+            cut = end
+
+        chunk = text[start:cut].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = cut
 
-    if current_chunk:
-        chunks.append(current_chunk.strip())
+    chunk = text[start:].strip()
+    if chunk:
+        chunks.append(chunk)
 
     return chunks
 
 
+_IMAGE_EXT = r'(?:png|jpg|jpeg|gif|bmp|webp|svg)'
+
+# Common ways an image path shows up in a response, merged into one
+# alternation so the text is scanned once. Explicit forms come before the
+# bare-path fallback so they win when both match at the same position.
+_IMAGE_PATH_RE = re.compile(
+    rf'(?:image|screenshot|photo|picture|saved|created|written|at|to)\s+(?:at|to|in)?\s*[:\s]*([~/\w\-./]+\.{_IMAGE_EXT})'
+    rf'|\[([^\]]+\.{_IMAGE_EXT})\]'
+    rf'|`([^`]+\.{_IMAGE_EXT})`'
+    rf'|([~/\w\-./]+\.{_IMAGE_EXT})',
+    re.IGNORECASE,
+)
+
+
 def extract_image_paths(text: str) -> List[str]:
     """
     Extract potential image file paths from text.
@@ -66,84 +81,74 @@ def extract_image_paths(text: str) -> List[str]:
     Returns:
         List of image file paths found
     """
-    # Pattern to match common image paths
-    patterns = [
-        r'(?:image|screenshot|photo|picture|saved|created|written|at|to)\s+(?:at|to|in)?\s*[:\s]*([~/\w\-./]+\.(?:png|jpg|jpeg|gif|bmp|webp|svg))',
-        r'([~/\w\-./]+\.(?:png|jpg|jpeg|gif|bmp|webp|svg))',
-        r'\[([^\]]+\.(?:png|jpg|jpeg|gif|bmp|webp|svg))\]',
-        r'`([^`]+\.(?:png|jpg|jpeg|gif|bmp|webp|svg))`',
-    ]
-
     found_paths = []
-    for pattern in patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
-            path = match.group(1) if match.lastindex >= 1 else match.group(0)
-            path = path.strip()
-            if path and path not in found_paths:
-                found_paths.append(path)
+    seen = set()
+    for match in _IMAGE_PATH_RE.finditer(text):
+        path = match.group(match.lastindex).strip()
+        if path and path not in seen:
+            seen.add(path)
+            found_paths.append(path)
 
     return found_paths
 
 
-async def send_image_from_path(
-    update: Update,
-    context: ContextTypes.DEFAULT_TYPE,
-    image_path: str,
-    caption: str = None
-) -> bool:
+async def load_image_from_path(image_path: str) -> Optional[InputFile]:
     """
-    Helper function to send an image from a file path to Telegram.
+    Read an image file into an InputFile ready to send to Telegram.
 
     Args:
-        update: Telegram update object
-        context: Telegram context object
         image_path: Path to the image file
-        caption: Optional caption for the image
 
     Returns:
-        True if image was sent successfully, False otherwise
+        InputFile named after the file, or None if the path isn't an
+        existing image file
     """
-    try:
-        # Expand user path if needed
-        image_path = os.path.expanduser(image_path)
+    # Expand user path if needed
+    image_path = os.path.expanduser(image_path)
+
+    # Check if it's an image file
+    valid_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+    if not image_path.lower().endswith(valid_extensions):
+        logger.debug("Not a valid image file: %s", image_path)
+        return None
 
-        if not os.path.exists(image_path):
-            logger.debug(f"Image path not found: {image_path}")
-            return False
+    # Read off the event loop so a large file doesn't stall other chats
+    image_data = await asyncio.to_thread(_read_file, image_path)
+    if image_data is None:
+        logger.debug("Image path not found: %s", image_path)
+        return None
 
-        # Check if it's an image file
-        valid_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
-        if not image_path.lower().endswith(valid_extensions):
-            logger.debug(f"Not a valid image file: {image_path}")
-            return False
+    return InputFile(image_data, filename=os.path.basename(image_path))
 
-        await context.bot.send_chat_action(
-            chat_id=update.effective_chat.id,
-            action="upload_photo"
-        )
 
-        # Send the image
-        with open(image_path, 'rb') as photo_file:
-            await update.message.reply_photo(
-                photo=photo_file,
-                caption=caption or f"📷 {os.path.basename(image_path)}"
-            )
+def _read_file(path: str) -> Optional[bytes]:
+    """
+    Read a file's contents (blocking).
+
+    Args:
+        path: Path to the file
+
+    Returns:
+        The file contents, or None if the file doesn't exist
+    """
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
 
-        logger.info(f"Image sent successfully: {image_path}")
-        return True
 
-    except Exception as e:
-        logger.error(f"Error sending image {image_path}: {e}")
-        return False
+# Display label per history role; anything other than 'user' is the assistant
+_ROLE_LABELS = {'user': 'User', 'assistant': 'Assistant'}
 
 
-def format_context_messages(history: list, max_exchanges: int = 10) -> str:
+def format_context_messages(history: Iterable[dict], max_exchanges: int = 10) -> str:
     """
     Format conversation history for context.
 
     Args:
-        history: List of message dictionaries with 'role' and 'content'
+        history: Sequence (list or deque) of messages with 'role' and 'content'
+            keys, e.g. dicts or session.Message records
         max_exchanges: Maximum number of message exchanges to include
 
     Returns:
@@ -152,13 +157,10 @@ def format_context_messages(history: list, max_exchanges: int = 10) -> str:
     if not history:
         return ""
 
-    context_messages = []
-    for msg in history[-max_exchanges * 2:]:  # 2 messages per exchange
-        role = msg["role"]
-        content = msg["content"]
-        if role == "user":
-            context_messages.append(f"User: {content}")
-        else:
-            context_messages.append(f"Assistant: {content}")
+    # 2 messages per exchange; islice works on deques, which can't be sliced
+    recent = islice(history, max(0, len(history) - max_exchanges * 2), None)
 
-    return "\n\n".join(context_messages)
+    return "\n\n".join(
+        f"{_ROLE_LABELS.get(msg['role'], 'Assistant')}: {msg['content']}"
+        for msg in recent
+    )
@@ -63,6 +63,12 @@ def test_utils():
         chunks = split_message(long_text, max_length=4000)
         assert len(chunks) > 1, "split_message should split long text"
 
+        paragraphs = ("x" * 3000 + "\n\n") * 3
+        chunks = split_message(paragraphs, max_length=4096)
+        assert chunks == ["x" * 3000] * 3, "split_message should break at paragraph boundaries"
+        assert all(len(chunk) <= 4096 for chunk in split_message("word " * 2000)), \
+            "split_message chunks should fit max_length"
+
         short_text = "Hello"
         chunks = split_message(short_text, max_length=4000)
         assert len(chunks) == 1, "split_message should not split short text"
@@ -70,7 +76,17 @@ def test_utils():
         # Test extract_image_paths
         text = "Here is an image at /path/to/image.png"
         paths = extract_image_paths(text)
-        assert len(paths) > 0, "extract_image_paths should find image paths"
+        assert paths == ["/path/to/image.png"], "extract_image_paths should find image paths"
+
+        paths = extract_image_paths("First b.png, then saved to /tmp/a.jpg, again b.png")
+        assert paths == ["b.png", "/tmp/a.jpg"], "image paths should be deduplicated, in text order"
+        assert extract_image_paths("See [my chart.png] here") == ["my chart.png"], \
+            "bracketed paths should be found whole, without bare-path fragments"
+        assert extract_image_paths("See `out dir/plot.gif` here") == ["out dir/plot.gif"], \
+            "backticked paths should be found whole, without bare-path fragments"
+        assert extract_image_paths("Screenshot saved to: ~/shots/s.webp") == ["~/shots/s.webp"], \
+            "paths introduced by a keyword should be found"
+        assert extract_image_paths("No images, just notes.txt") == [], "non-image files should be ignored"
 
         print("✅ PASS: Utilities work correctly")
         return True
@@ -79,34 +95,248 @@ def test_utils():
         return False
 
 
+def test_image_detection():
+    """Test recognizing image uploads by their leading bytes."""
+    print("\nTesting image detection...")
+    try:
+        from telegram_claude_bot.handlers.messages import _is_image
+
+        assert _is_image(b'\x89PNG\r\n\x1a\n' + b'\x00' * 16), "PNG should be detected"
+        assert _is_image(b'\xff\xd8\xff\xe0' + b'\x00' * 16), "JPEG should be detected"
+        assert _is_image(b'GIF87a' + b'\x00' * 16), "GIF87a should be detected"
+        assert _is_image(b'GIF89a' + b'\x00' * 16), "GIF89a should be detected"
+        assert _is_image(b'RIFF\x24\x00\x00\x00WEBPVP8 '), "WebP should be detected"
+        assert not _is_image(b'RIFF\x24\x00\x00\x00WAVEfmt '), "WAV (non-WebP RIFF) should be rejected"
+        assert not _is_image(b'Hello, this is plain text'), "plain text should be rejected"
+        assert not _is_image(b''), "empty content should be rejected"
+
+        print("✅ PASS: Image detection works correctly")
+        return True
+    except Exception as e:
+        print(f"❌ FAIL: Image detection error - {e}")
+        return False
+
+
+def test_prompt_batching():
+    """Test that queued text messages are batched, with edits left out."""
+    print("\nTesting prompt batching...")
+    try:
+        import asyncio
+        from collections import deque
+        from dataclasses import replace
+        from types import SimpleNamespace
+        from telegram_claude_bot.handlers import messages
+    except Exception as e:
+        print(f"❌ FAIL: Prompt batching error - {e}")
+        return False
+
+    original = (messages.config, messages._respond, messages._process_message)
+    try:
+        answered = []
+
+        async def respond(update, context, chat_id, text):
+            answered.append(text)
+
+        async def process_message(update, context):
+            answered.append(update.message.text if update.message else None)
+
+        messages.config = replace(original[0], batch_prompts=True)
+        messages._respond = respond
+        messages._process_message = process_message
+
+        def text(value):
+            return SimpleNamespace(message=SimpleNamespace(text=value, photo=(), document=None))
+
+        # An edited message has no update.message
+        queue = deque((update, None) for update in (
+            text("one"), text("two"), SimpleNamespace(message=None), text("three")
+        ))
+        asyncio.run(messages._chat_worker(12345, queue))
+        assert answered == ["one\n\ntwo", None, "three"], "texts before an edit should be batched and answered"
+
+        print("✅ PASS: Prompt batching works correctly")
+        return True
+    except Exception as e:
+        print(f"❌ FAIL: Prompt batching error - {e}")
+        return False
+    finally:
+        messages.config, messages._respond, messages._process_message = original
+
+
 def test_session_manager():
     """Test session manager."""
     print("\nTesting session manager...")
     try:
-        from telegram_claude_bot.session import get_session_manager
+        import asyncio
+        import tempfile
+        from collections import deque
+        from telegram_claude_bot.config import config
+        from telegram_claude_bot.session import SessionManager
+
+        # A throwaway history dir, so HISTORY_DIR's real transcripts are never touched
+        with tempfile.TemporaryDirectory() as history_dir:
+            session_manager = SessionManager(history_dir)
+
+            # Test get_history
+            history = asyncio.run(session_manager.get_history(12345))
+            assert isinstance(history, deque), "get_history should return a deque"
+
+            # Test add_message
+            asyncio.run(session_manager.add_message(12345, "user", "Hello"))
+            history = asyncio.run(session_manager.get_history(12345))
+            assert len(history) == 1, "add_message should add to history"
+            assert history[0]["role"] == "user", "Message role should be 'user'"
+            assert history[0]["content"] == "Hello", "Message content should match"
+
+            # Test history is bounded
+            for i in range(config.max_history_length + 5):
+                asyncio.run(session_manager.add_message(12345, "user", f"Message {i}"))
+            history = asyncio.run(session_manager.get_history(12345))
+            assert len(history) == config.max_history_length, "history should be capped at max_history_length"
+            assert history[-1]["content"] == f"Message {config.max_history_length + 4}", "newest message should be kept"
+
+            # Test get_context trims old messages to the size budget
+            for _ in range(10):
+                asyncio.run(session_manager.add_message(12345, "user", "x" * (config.max_history_chars // 10)))
+            context = asyncio.run(session_manager.get_context(12345))
+            assert len(context) == len(history), "get_context should keep every message"
+            assert context[0]["content"] == "[archived]", "oldest messages should be archived"
+            assert context[-1]["content"] == history[-1]["content"], "recent messages should be kept whole"
+            assert sum(len(m["content"]) for m in context) <= config.max_history_chars, "context should fit the budget"
+            assert history[0]["content"] != "[archived]", "stored history should be untouched"
+
+            # Test clear_history
+            asyncio.run(session_manager.clear_history(12345))
+            history = asyncio.run(session_manager.get_history(12345))
+            assert len(history) == 0, "clear_history should clear all messages"
+
+            # Test get_lock
+            lock = session_manager.get_lock(12345)
+            assert lock is session_manager.get_lock(12345), "get_lock should reuse a chat's lock"
+            assert lock is not session_manager.get_lock(67890), "get_lock should isolate chats"
 
-        session_manager = get_session_manager()
+        print("✅ PASS: Session manager works correctly")
+        return True
+    except Exception as e:
+        print(f"❌ FAIL: Session manager error - {e}")
+        return False
 
-        # Test get_history
-        history = session_manager.get_history(12345)
-        assert isinstance(history, list), "get_history should return a list"
 
-        # Test add_message
-        session_manager.add_message(12345, "user", "Hello")
-        history = session_manager.get_history(12345)
-        assert len(history) == 1, "add_message should add to history"
-        assert history[0]["role"] == "user", "Message role should be 'user'"
-        assert history[0]["content"] == "Hello", "Message content should match"
+def test_history_persistence():
+    """Test that history survives a restart when persisted."""
+    print("\nTesting history persistence...")
+    try:
+        import asyncio
+        import tempfile
+        from telegram_claude_bot.config import config
+        from telegram_claude_bot.session import Message, SessionManager
+
+        with tempfile.TemporaryDirectory() as history_dir:
+            session_manager = SessionManager(history_dir)
+            asyncio.run(session_manager.add_message(12345, "user", "Hello"))
+            asyncio.run(session_manager.add_message(12345, "assistant", "Hi there"))
+
+            # A new manager reads the transcript back
+            restored = asyncio.run(SessionManager(history_dir).get_history(12345))
+            assert list(restored) == [
+                Message("user", "Hello"),
+                Message("assistant", "Hi there"),
+            ], "history should be restored from the transcript"
+
+            # The transcript is compacted instead of growing without bound
+            for i in range(config.max_history_length * 3):
+                asyncio.run(session_manager.add_message(12345, "user", f"Message {i}"))
+            with open(os.path.join(history_dir, "12345.jsonl"), encoding="utf-8") as f:
+                line_count = sum(1 for _ in f)
+            assert line_count < 2 * config.max_history_length, "transcript should be compacted"
+            restored = asyncio.run(SessionManager(history_dir).get_history(12345))
+            assert restored[-1].content == f"Message {config.max_history_length * 3 - 1}", \
+                "compaction should keep the newest messages"
+            assert len(restored) == config.max_history_length, "compaction should keep a full history"
+
+            # Clearing removes the transcript
+            asyncio.run(session_manager.clear_history(12345))
+            restored = asyncio.run(SessionManager(history_dir).get_history(12345))
+            assert len(restored) == 0, "clear_history should remove the transcript"
+
+        print("✅ PASS: History persistence works correctly")
+        return True
+    except Exception as e:
+        print(f"❌ FAIL: History persistence error - {e}")
+        return False
 
-        # Test clear_history
-        session_manager.clear_history(12345)
-        history = session_manager.get_history(12345)
-        assert len(history) == 0, "clear_history should clear all messages"
 
-        print("✅ PASS: Session manager works correctly")
+def test_history_eviction():
+    """Test that only the most recently used chats' history stays in memory."""
+    print("\nTesting history eviction...")
+    session = original_config = None
+    try:
+        import asyncio
+        import tempfile
+        from dataclasses import replace
+        from telegram_claude_bot import session
+
+        original_config = session.config
+        # Allow two chats in memory
+        session.config = replace(original_config, max_cached_chats=2)
+
+        with tempfile.TemporaryDirectory() as history_dir:
+            session_manager = session.SessionManager(history_dir)
+            asyncio.run(session_manager.add_message(1, "user", "Hello from 1"))
+            asyncio.run(session_manager.add_message(2, "user", "Hello from 2"))
+            asyncio.run(session_manager.get_history(1))  # chat 2 is now least recently used
+            asyncio.run(session_manager.add_message(3, "user", "Hello from 3"))
+            assert list(session_manager.conversations) == [1, 3], "least recently used chat should be evicted"
+
+            # The evicted chat is reloaded from its transcript
+            history = asyncio.run(session_manager.get_history(2))
+            assert [m.content for m in history] == ["Hello from 2"], "evicted chat should reload from its transcript"
+            assert list(session_manager.conversations) == [3, 2], "reloading should evict the next oldest chat"
+
+        print("✅ PASS: History eviction works correctly")
         return True
     except Exception as e:
-        print(f"❌ FAIL: Session manager error - {e}")
+        print(f"❌ FAIL: History eviction error - {e}")
+        return False
+    finally:
+        if original_config is not None:
+            session.config = original_config
+
+
+def test_clear_waits_for_turn():
+    """Test that clearing a chat waits for its turn in progress."""
+    print("\nTesting clear during a turn...")
+    try:
+        import asyncio
+        import tempfile
+        from telegram_claude_bot.claude_manager import shutdown_claude_manager
+        from telegram_claude_bot.session import SessionManager
+
+        async def clear_during_turn(session_manager):
+            try:
+                async with session_manager.get_lock(12345):
+                    clear = asyncio.create_task(session_manager.clear_all(12345))
+                    await asyncio.sleep(0)
+                    assert not clear.done(), "clear_all should wait for the chat's lock"
+                    # The turn in progress finishes by recording its exchange
+                    await session_manager.add_message(12345, "user", "Hello")
+                    await session_manager.add_message(12345, "assistant", "Hi there")
+                await clear
+            finally:
+                # In CLI mode clear_all starts the global process manager
+                await shutdown_claude_manager()
+
+        with tempfile.TemporaryDirectory() as history_dir:
+            session_manager = SessionManager(history_dir)
+            asyncio.run(clear_during_turn(session_manager))
+            assert len(asyncio.run(session_manager.get_history(12345))) == 0, "the turn's messages should be cleared"
+            restored = asyncio.run(SessionManager(history_dir).get_history(12345))
+            assert len(restored) == 0, "the turn's messages should be cleared from the transcript"
+
+        print("✅ PASS: Clear waits for the turn in progress")
+        return True
+    except Exception as e:
+        print(f"❌ FAIL: Clear during a turn error - {e}")
         return False
 
 
@@ -121,7 +351,12 @@ def main():
     results.append(("Imports", test_imports()))
     results.append(("Configuration", test_config()))
     results.append(("Utilities", test_utils()))
+    results.append(("Image Detection", test_image_detection()))
+    results.append(("Prompt Batching", test_prompt_batching()))
     results.append(("Session Manager", test_session_manager()))
+    results.append(("History Persistence", test_history_persistence()))
+    results.append(("History Eviction", test_history_eviction()))
+    results.append(("Clear During Turn", test_clear_waits_for_turn()))
 
     print("\n" + "=" * 60)
     print("Test Results Summary")